@@ -0,0 +1,87 @@
+"""
+CPU-bound analytics, run in the worker processes of offload.py.
+
+The functions here only take and return compact buffers of numbers, never ORM
+objects, and the module imports nothing of the app so the workers start fast.
+"""
+from array import array
+from datetime import date
+
+LOG_FIELDS = 4  # per packed exercise log: day ordinal, sets, reps, intensity
+PROGRESSION_FIELDS = 6  # per day of a progression: day ordinal, volume, top intensity, acute, chronic, ratio
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+
+
+def pack_exercise_logs(exercise_logs) -> bytes:
+    """
+    Pack exercise logs into a buffer of 64-bit integers.
+
+    :param exercise_logs: The date (a date or datetime), sets, reps and intensity of each log.
+    :return: The buffer, LOG_FIELDS integers per log.
+    """
+    values = array("q")
+    for day, sets, reps, intensity in exercise_logs:
+        values.extend((day.toordinal(), sets, reps, intensity))
+    return values.tobytes()
+
+
+def exercise_progression(buffer: bytes) -> bytes:
+    """
+    Compute the daily progression of an exercise from its packed logs.
+
+    The load of a log is sets x reps x intensity. For each training day it gives
+    the volume, the top intensity, the acute (7 days) and chronic (28 days)
+    average daily load ending that day, and their ratio.
+
+    :param buffer: The logs, as packed by `pack_exercise_logs`, in any order.
+    :return: PROGRESSION_FIELDS doubles per training day, by date.
+    """
+    logs = array("q")
+    logs.frombytes(buffer)
+    volumes: dict[int, int] = {}
+    top_intensities: dict[int, int] = {}
+    for index in range(0, len(logs), LOG_FIELDS):
+        day, sets, reps, intensity = logs[index:index + LOG_FIELDS]
+        volumes[day] = volumes.get(day, 0) + sets * reps * intensity
+        top_intensities[day] = max(top_intensities.get(day, 0), intensity)
+
+    days = sorted(volumes)
+    result = array("d")
+    # sliding windows over the training days, the days in between have no load
+    acute_start = chronic_start = 0
+    acute_load = chronic_load = 0
+    for end, day in enumerate(days):
+        acute_load += volumes[day]
+        chronic_load += volumes[day]
+        while days[acute_start] <= day - ACUTE_DAYS:
+            acute_load -= volumes[days[acute_start]]
+            acute_start += 1
+        while days[chronic_start] <= day - CHRONIC_DAYS:
+            chronic_load -= volumes[days[chronic_start]]
+            chronic_start += 1
+        acute, chronic = acute_load / ACUTE_DAYS, chronic_load / CHRONIC_DAYS
+        result.extend((day, volumes[day], top_intensities[day], acute, chronic, acute / chronic if chronic else 0.0))
+    return result.tobytes()
+
+
+def unpack_progression(buffer: bytes) -> list[dict]:
+    """
+    Unpack the result of `exercise_progression`.
+
+    :param buffer: The packed progression.
+    :return: The progression, one dictionary per training day.
+    """
+    values = array("d")
+    values.frombytes(buffer)
+    return [
+        {
+            "date": date.fromordinal(int(values[index])),
+            "volume": int(values[index + 1]),
+            "top_intensity": int(values[index + 2]),
+            "acute_load": values[index + 3],
+            "chronic_load": values[index + 4],
+            "load_ratio": values[index + 5],
+        }
+        for index in range(0, len(values), PROGRESSION_FIELDS)
+    ]
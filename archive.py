@@ -0,0 +1,378 @@
+import argparse
+import json
+import logging
+import zlib
+from datetime import date, datetime, time, timedelta, timezone
+from typing import AsyncIterator
+from tortoise import Tortoise, run_async
+from tortoise.transactions import in_transaction
+from database import TORTOISE_ORM
+from models import CalendarEntry, ExerciseLog, ExerciseSummary, User, WorkoutArchive, WorkoutSession
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Archived tables and their columns. Each archive row holds one month of a
+# user's sessions with everything hanging off them, stored column by column.
+ARCHIVE_TABLES = {
+    "sessions": (WorkoutSession, ("id", "date", "comments")),
+    "exercise_logs": (
+        ExerciseLog,
+        ("id", "workout_session_id", "exercise_id", "date", "sets", "reps", "intensity", "exertion_scale"),
+    ),
+    "exercise_summaries": (
+        ExerciseSummary,
+        ("id", "exercise_log_id", "total_sets", "total_reps", "total_holds"),
+    ),
+    "calendar_entries": (CalendarEntry, ("id", "workout_session_id", "date")),
+}
+DATE_COLUMNS = {"date"}
+# filter columns holding ids of an archived table, bounded by that table's id range in the lookup
+ID_COLUMNS = {"workout_session_id": "sessions", "exercise_log_id": "exercise_logs"}
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def to_utc_datetime(day: date) -> datetime:
+    if isinstance(day, datetime):
+        return day if day.tzinfo else day.replace(tzinfo=timezone.utc)
+    return datetime.combine(day, time(), tzinfo=timezone.utc)
+
+
+def get_archive_cutoff(max_age_days: int = None, today: date = None) -> date:
+    """
+    Get the first month that stays in the hot tables, older months are archived.
+
+    :param max_age_days: The age after which history is archived, defaults to ARCHIVE_AFTER_DAYS.
+    :param today: The current date, defaults to today in UTC like the session dates.
+    :return: The first day of the month.
+    """
+    if max_age_days is None:
+        max_age_days = settings.ARCHIVE_AFTER_DAYS
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+    return month_start(today - timedelta(days=max_age_days))
+
+
+def encode_archive(tables: dict[str, list[dict]]) -> bytes:
+    """
+    Compress rows into the columnar archive format.
+
+    :param tables: The rows of each archived table.
+    :return: zlib compressed JSON, one list of values per column.
+    """
+    columnar = {}
+    for table, (_, columns) in ARCHIVE_TABLES.items():
+        rows = tables.get(table, [])
+        columnar[table] = {
+            column: [
+                row[column].isoformat() if column in DATE_COLUMNS else row[column] for row in rows
+            ]
+            for column in columns
+        }
+    return zlib.compress(json.dumps(columnar, separators=(",", ":")).encode())
+
+
+def decode_archive(data: bytes) -> dict[str, list[dict]]:
+    """
+    Decompress an archive back into rows.
+
+    :param data: The archive as written by `encode_archive`.
+    :return: The rows of each archived table.
+    """
+    columnar = json.loads(zlib.decompress(data))
+    tables = {}
+    for table, columns in columnar.items():
+        names = list(columns)
+        rows = [dict(zip(names, values)) for values in zip(*columns.values())]
+        for row in rows:
+            for column in DATE_COLUMNS.intersection(names):
+                row[column] = datetime.fromisoformat(row[column])
+        tables[table] = rows
+    return tables
+
+
+def build_lookup(tables: dict[str, list[dict]]) -> dict:
+    """
+    Index an archive, so lookups only decompress the months that may hold a row.
+
+    :param tables: The rows of each archived table.
+    :return: The id range of each table and the exercises logged.
+    """
+    ranges = {}
+    for table, rows in tables.items():
+        if rows:
+            ids = [row["id"] for row in rows]
+            ranges[table] = [min(ids), max(ids)]
+    exercise_ids = {exercise_log["exercise_id"] for exercise_log in tables.get("exercise_logs", [])}
+    return {"ids": ranges, "exercise_ids": sorted(exercise_ids)}
+
+
+def encode_sessions(sessions: list[dict]) -> list[dict]:
+    # the sessions are also kept uncompressed, listing them needs no decompression
+    return [
+        {column: value.isoformat() if column in DATE_COLUMNS else value for column, value in session.items()}
+        for session in sessions
+    ]
+
+
+def may_contain(lookup: dict | None, table: str, filters: dict) -> bool:
+    """
+    Check an archive's lookup for whether it may hold rows matching the filters.
+
+    :param lookup: The lookup, as built by `build_lookup`, None for archives written without one.
+    :param table: The archived table, a key of ARCHIVE_TABLES.
+    :param filters: Column values the rows must have.
+    :return: False if the archive can't hold a matching row.
+    """
+    if lookup is None:
+        return True
+    for column, value in filters.items():
+        if column == "exercise_id":
+            if value not in lookup["exercise_ids"]:
+                return False
+        elif column == "id" or column in ID_COLUMNS:
+            id_range = lookup["ids"].get(table if column == "id" else ID_COLUMNS[column])
+            if id_range is None or not id_range[0] <= value <= id_range[1]:
+                return False
+    return True
+
+
+async def archive_user_month(user_id: str, month: date) -> int:
+    """
+    Move a month of a user's sessions, with their logs, summaries and calendar entries, into the archive.
+
+    Sessions already archived for that month are kept, the new ones are added.
+
+    :param user_id: The ID of the user.
+    :param month: Any day of the month.
+    :return: The number of sessions archived.
+    """
+    month = month_start(month)
+    async with in_transaction("default") as connection:
+        session_model, session_columns = ARCHIVE_TABLES["sessions"]
+        sessions = await session_model.filter(
+            user_id=user_id,
+            date__gte=to_utc_datetime(month),
+            date__lt=to_utc_datetime(next_month(month)),
+        ).using_db(connection).values(*session_columns)
+        if not sessions:
+            return 0
+        session_ids = [session["id"] for session in sessions]
+        log_model, log_columns = ARCHIVE_TABLES["exercise_logs"]
+        exercise_logs = await log_model.filter(workout_session_id__in=session_ids).using_db(
+            connection
+        ).values(*log_columns)
+        summary_model, summary_columns = ARCHIVE_TABLES["exercise_summaries"]
+        exercise_summaries = await summary_model.filter(
+            exercise_log_id__in=[exercise_log["id"] for exercise_log in exercise_logs]
+        ).using_db(connection).values(*summary_columns)
+        entry_model, entry_columns = ARCHIVE_TABLES["calendar_entries"]
+        calendar_entries = await entry_model.filter(workout_session_id__in=session_ids).using_db(
+            connection
+        ).values(*entry_columns)
+
+        archive_obj = await WorkoutArchive.filter(user_id=user_id, month=month).using_db(
+            connection
+        ).select_for_update().first()
+        tables = decode_archive(archive_obj.data) if archive_obj else {}
+        new_tables = {
+            "sessions": sessions,
+            "exercise_logs": exercise_logs,
+            "exercise_summaries": exercise_summaries,
+            "calendar_entries": calendar_entries,
+        }
+        for table, rows in new_tables.items():
+            tables[table] = tables.get(table, []) + rows
+        columns = {
+            "data": encode_archive(tables),
+            "lookup": build_lookup(tables),
+            "sessions": encode_sessions(tables["sessions"]),
+        }
+        if archive_obj:
+            await archive_obj.update_from_dict(columns).save(
+                using_db=connection, update_fields=list(columns)
+            )
+        else:
+            await WorkoutArchive.create(user_id=user_id, month=month, **columns, using_db=connection)
+        # logs, summaries and calendar entries go with their sessions
+        await session_model.filter(id__in=session_ids).using_db(connection).delete()
+    return len(sessions)
+
+
+async def archive_old_history(max_age_days: int = None) -> int:
+    """
+    Archive every month older than the archive age, for all users.
+
+    :param max_age_days: The age after which history is archived, defaults to ARCHIVE_AFTER_DAYS.
+    :return: The number of sessions archived.
+    """
+    cutoff = get_archive_cutoff(max_age_days)
+    months = await Tortoise.get_connection("default").execute_query_dict(
+        "SELECT DISTINCT \"user_id\", date_trunc('month', \"date\" AT TIME ZONE 'UTC')::date AS \"month\" "
+        'FROM "workoutsession" WHERE "date" < $1',
+        [to_utc_datetime(cutoff)],
+    )
+    archived = 0
+    for row in months:
+        archived += await archive_user_month(row["user_id"], row["month"])
+    logger.info("Archived %s sessions older than %s", archived, cutoff)
+    return archived
+
+
+async def read_archives(archive_ids: list[int], table: str) -> list[dict]:
+    """
+    Read a table's rows out of archives, the sessions from their uncompressed copy when there is one.
+
+    :param archive_ids: The IDs of the archives, rows are returned in their order.
+    :param table: The archived table, a key of ARCHIVE_TABLES.
+    :return: The archived rows.
+    """
+    if not archive_ids:
+        return []
+    archives = WorkoutArchive.filter(id__in=archive_ids)
+    by_id = {}
+    if table == "sessions":
+        for archive_id, sessions in await archives.values_list("id", "sessions"):
+            if sessions is not None:
+                by_id[archive_id] = [
+                    {
+                        column: datetime.fromisoformat(value) if column in DATE_COLUMNS else value
+                        for column, value in session.items()
+                    }
+                    for session in sessions
+                ]
+        archives = archives.exclude(id__in=list(by_id))
+    if len(by_id) < len(archive_ids):
+        for archive_id, data in await archives.values_list("id", "data"):
+            by_id[archive_id] = decode_archive(data)[table]
+    return [row for archive_id in archive_ids for row in by_id[archive_id]]
+
+
+async def get_archived_rows(user: User, table: str, start: date = None, end: date = None) -> list[dict]:
+    """
+    Read rows of a user back from the archive.
+
+    :param user: The user whose archive is read.
+    :param table: The archived table, a key of ARCHIVE_TABLES.
+    :param start: Only read months from the one of this date, if given.
+    :param end: Only read months before this date, if given.
+    :return: The archived rows.
+    """
+    archives = WorkoutArchive.filter(user=user)
+    if start is not None:
+        archives = archives.filter(month__gte=month_start(start))
+    if end is not None:
+        archives = archives.filter(month__lt=end)
+    return await read_archives(await archives.order_by("month").values_list("id", flat=True), table)
+
+
+async def iter_archived_rows(user: User, table: str) -> AsyncIterator[list[dict]]:
+    """
+    Read a user's rows back from the archive one month at a time, to bound memory.
+
+    :param user: The user whose archive is read.
+    :param table: The archived table, a key of ARCHIVE_TABLES.
+    :return: The archived rows of each month.
+    """
+    months = await WorkoutArchive.filter(user=user).order_by("month").values_list("id", flat=True)
+    for archive_id in months:
+        data = await WorkoutArchive.filter(id=archive_id).values_list("data", flat=True)
+        yield decode_archive(data[0])[table]
+
+
+async def filter_archived_rows(user: User, table: str, **filters) -> list[dict]:
+    """
+    Get the archived rows of a user matching all the filters.
+
+    :param user: The user whose archive is searched.
+    :param table: The archived table, a key of ARCHIVE_TABLES.
+    :param filters: Column values the rows must have.
+    :return: The matching rows.
+    """
+    # only the months whose lookup may hold a match are decompressed, none for ids newer than the archive
+    archives = await WorkoutArchive.filter(user=user).order_by("month").values_list("id", "lookup")
+    archive_ids = [archive_id for archive_id, lookup in archives if may_contain(lookup, table, filters)]
+    return [
+        row
+        for row in await read_archives(archive_ids, table)
+        if all(row[column] == value for column, value in filters.items())
+    ]
+
+
+async def find_archived_row(user: User, table: str, **filters) -> dict | None:
+    """
+    Find an archived row of a user matching all the filters.
+
+    :param user: The user whose archive is searched.
+    :param table: The archived table, a key of ARCHIVE_TABLES.
+    :param filters: Column values the row must have.
+    :return: The row, or None if there is no such row.
+    """
+    rows = await filter_archived_rows(user, table, **filters)
+    return rows[0] if rows else None
+
+
+async def get_archived_exercise_logs(user: User, start: date, end: date) -> list[dict]:
+    """
+    Get the archived exercise logs of a user within a date range.
+
+    Only reads the archive when the range starts before the archive cutoff.
+
+    :param user: The user whose logs are read.
+    :param start: The start of the range.
+    :param end: The end of the range, excluded.
+    :return: The archived logs.
+    """
+    if to_utc_datetime(start) >= to_utc_datetime(get_archive_cutoff()):
+        return []
+    start, end = to_utc_datetime(start), to_utc_datetime(end)
+    return [
+        exercise_log
+        for exercise_log in await get_archived_rows(user, "exercise_logs", start.date(), end.date())
+        if start <= exercise_log["date"] < end
+    ]
+
+
+async def reindex_archives() -> int:
+    """
+    Build the lookups of archives written before they were kept, one archive at a time.
+
+    :return: The number of archives indexed.
+    """
+    archive_ids = await WorkoutArchive.filter(lookup__isnull=True).values_list("id", flat=True)
+    for archive_id in archive_ids:
+        data = await WorkoutArchive.filter(id=archive_id).values_list("data", flat=True)
+        tables = decode_archive(data[0])
+        await WorkoutArchive.filter(id=archive_id).update(
+            lookup=build_lookup(tables), sessions=encode_sessions(tables["sessions"])
+        )
+    return len(archive_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old workout history into the archive")
+    parser.add_argument("--max-age-days", type=int, default=None)
+    parser.add_argument(
+        "--reindex", action="store_true", help="build the lookups of archives that lack them, then exit"
+    )
+    args = parser.parse_args()
+
+    async def run():
+        await Tortoise.init(config=TORTOISE_ORM)
+        if args.reindex:
+            print(f"Indexed {await reindex_archives()} archives")
+            return
+        print(f"Archived {await archive_old_history(args.max_age_days)} sessions")
+
+    run_async(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of the streaming export on a large history.
+
+Seeds a throwaway user with `--rows` exercise logs through COPY, exports them
+in each format and reports the time taken and the peak Python memory of the
+export, then deletes the user. Runs against the database of TORTOISE_ORM:
+
+    python benchmarks/export_benchmark.py --rows 1000000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tortoise import Tortoise, run_async
+from database import TORTOISE_ORM
+from export import EXPORT_MEDIA_TYPES, stream_user_table
+from models import Exercise, User, WorkoutSession
+
+
+async def seed(user: User, rows: int) -> None:
+    exercise = await Exercise.create(
+        user=user, name="bench", description="bench", category="bench", muscle_group="bench"
+    )
+    session = await WorkoutSession.create(user=user, comments="bench")
+    start = datetime.now(timezone.utc) - timedelta(days=60)
+    records = (
+        (user.pk, session.id, exercise.id, start + timedelta(seconds=i), 3, 10, 70, 7)
+        for i in range(rows)
+    )
+    client = Tortoise.get_connection("default")
+    async with client.acquire_connection() as connection:
+        await connection.copy_records_to_table(
+            "exerciselog",
+            records=records,
+            columns=(
+                "user_id", "workout_session_id", "exercise_id", "date",
+                "sets", "reps", "intensity", "exertion_scale",
+            ),
+        )
+
+
+async def export(user: User, export_format: str, chunk_size: int) -> int:
+    size = 0
+    async for chunk in stream_user_table(user, "exercise-logs", export_format, chunk_size):
+        size += len(chunk)
+    return size
+
+
+async def run(args: argparse.Namespace) -> None:
+    await Tortoise.init(config=TORTOISE_ORM)
+    user = await User.create(object_id=f"export-benchmark-{uuid.uuid4()}")
+    try:
+        started = time.perf_counter()
+        await seed(user, args.rows)
+        print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+        for export_format in EXPORT_MEDIA_TYPES:
+            started = time.perf_counter()
+            size = await export(user, export_format, args.chunk_size)
+            elapsed = time.perf_counter() - started
+            tracemalloc.start()
+            await export(user, export_format, args.chunk_size)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{export_format:>8}: {elapsed:6.2f}s {args.rows / elapsed:>10,.0f} rows/s "
+                f"{size / 2**20:8.1f} MiB out, peak memory {peak / 2**20:.1f} MiB"
+            )
+    finally:
+        await user.delete()
+        await Tortoise.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming export")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    run_async(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
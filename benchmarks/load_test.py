@@ -0,0 +1,209 @@
+"""
+Load test of the API routes against users seeded by benchmarks/seed.py.
+
+Runs the app in process, with `azure_scheme` stubbed like in conftest.py, the
+user of each request being picked from the seeded ones. Concurrent workers
+send a weighted mix of requests for a while, then the latency percentiles
+and throughput of each endpoint are reported:
+
+    python benchmarks/seed.py --users 10000 --logs 10000000
+    python benchmarks/load_test.py --concurrency 50 --duration 60
+
+Latencies include the in-process HTTP client, and the app's caches warm up
+during the run like in production.
+The per user rate limits are off unless --rate-limit is passed.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import Request
+from fastapi_azure_auth.user import User
+from httpx import ASGITransport, AsyncClient
+from tortoise import Tortoise
+from database import TORTOISE_ORM
+from project import app, azure_scheme
+from ratelimit import set_rate_limiter
+
+USER_HEADER = "x-load-test-user"
+
+
+async def stub_user(request: Request) -> User:
+    user = User(
+        claims={},
+        preferred_username="LoadTestUser",
+        roles=[],
+        aud="aud",
+        tid="tid",
+        access_token="123",
+        is_guest=False,
+        iat=1537231048,
+        nbf=1537231048,
+        exp=1537234948,
+        iss="iss",
+        aio="aio",
+        sub=request.headers[USER_HEADER],
+        oid="oid",
+        uti="uti",
+        rh="rh",
+        ver="2.0",
+    )
+    request.state.user = user
+    return user
+
+
+def request_mix(sample: dict) -> list[tuple[str, str, str, dict | None, int]]:
+    """
+    The requests of the mix for one user: endpoint, method, path, body, weight.
+    """
+    today = date.today()
+    past = random.randint(1, 23)
+    year, month = divmod(today.year * 12 + today.month - 1 - past, 12)
+    return [
+        ("GET /workout-plans", "GET", "/workout-plans", None, 5),
+        ("GET /workout-sessions", "GET", "/workout-sessions", None, 10),
+        ("GET /workout-session/{id}", "GET", f"/workout-session/{sample['session']}", None, 10),
+        (
+            "GET /exercise-logs/workout-session/{id}",
+            "GET",
+            f"/exercise-logs/workout-session/{sample['session']}",
+            None,
+            15,
+        ),
+        ("GET /exercises", "GET", "/exercises", None, 10),
+        (
+            "GET /exercise-summary/exercise-log/{id}",
+            "GET",
+            f"/exercise-summary/exercise-log/{sample['log']}",
+            None,
+            10,
+        ),
+        (
+            "GET /exercise-summary/{year}/{month} (current)",
+            "GET",
+            f"/exercise-summary/{today.year}/{today.month}",
+            None,
+            15,
+        ),
+        (
+            "GET /exercise-summary/{year}/{month} (past)",
+            "GET",
+            f"/exercise-summary/{year}/{month + 1}",
+            None,
+            15,
+        ),
+        (
+            "POST /exercise-logs/workout-session/{id}",
+            "POST",
+            f"/exercise-logs/workout-session/{sample['session']}",
+            {
+                "exercise_id": sample["exercise"],
+                "sets": random.randint(1, 6),
+                "reps": random.randint(1, 15),
+                "intensity": random.randint(40, 100),
+                "exertion_scale": random.randint(1, 10),
+            },
+            10,
+        ),
+    ]
+
+
+async def load_samples(prefix: str, users: int) -> list[dict]:
+    """
+    Pick seeded users, with a session, an exercise log and an exercise of each.
+    """
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        'SELECT DISTINCT ON ("user_id") "user_id", "workout_session_id", "id", "exercise_id" '
+        'FROM "exerciselog" WHERE "user_id" LIKE $1 ORDER BY "user_id" LIMIT $2',
+        [prefix + "%", users],
+    )
+    return [
+        {"user": row["user_id"], "session": row["workout_session_id"], "log": row["id"], "exercise": row["exercise_id"]}
+        for row in rows
+    ]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run(args: argparse.Namespace) -> dict:
+    await Tortoise.init(config=TORTOISE_ORM)
+    samples = await load_samples(args.prefix, args.users)
+    if not samples:
+        raise SystemExit(f"No seeded users named {args.prefix}*, run benchmarks/seed.py first")
+    app.dependency_overrides[azure_scheme] = stub_user
+    if not args.rate_limit:
+        # past their burst the seeded users would mostly get 429s
+        set_rate_limiter(None)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(client: AsyncClient):
+        while time.perf_counter() < deadline:
+            sample = random.choice(samples)
+            requests = request_mix(sample)
+            endpoint, method, path, body, _ = random.choices(
+                requests, weights=[request[-1] for request in requests]
+            )[0]
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body, headers={USER_HEADER: sample["user"]})
+            latencies[endpoint].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[endpoint] += 1
+
+    started = time.perf_counter()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://load-test") as client:
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    await Tortoise.close_connections()
+
+    report = {}
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        report[endpoint] = {
+            "requests": len(values),
+            "errors": errors[endpoint],
+            "throughput": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.0f} req/s, concurrency {args.concurrency}")
+    print(f"{'endpoint':<48} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in report.items():
+        print(
+            f"{endpoint:<48} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>8.1f} "
+            f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}"
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API against seeded users")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--users", type=int, default=1000, help="seeded users to spread the load over")
+    parser.add_argument("--prefix", default="load-user-")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the per user rate limits on")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark of the overhead MetricsMiddleware adds to a request.
+
+Calls a trivial ASGI app directly and through the middleware, and reports
+the difference per request. The target is under 50µs:
+
+    python benchmarks/metrics_benchmark.py --requests 100000
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from metrics import MetricsMiddleware, RequestMetrics
+
+
+class Route:
+    path = "/workout-plan/{id}"
+
+
+async def app(scope, receive, send):
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+async def time_requests(asgi_app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await asgi_app({"type": "http", "method": "GET", "path": "/workout-plan/1"}, receive, send)
+    return time.perf_counter() - started
+
+
+async def run(requests: int) -> None:
+    middleware = MetricsMiddleware(app, RequestMetrics())
+    # warm up, then keep the best of a few rounds of each
+    await time_requests(app, requests // 10)
+    await time_requests(middleware, requests // 10)
+    bare = min([await time_requests(app, requests) for _ in range(3)])
+    measured = min([await time_requests(middleware, requests) for _ in range(3)])
+    overhead = (measured - bare) / requests * 1e6
+    print(f"bare: {bare / requests * 1e6:.2f}µs/request, with metrics: {measured / requests * 1e6:.2f}µs/request")
+    print(f"overhead: {overhead:.2f}µs/request ({'under' if overhead < 50 else 'OVER'} the 50µs budget)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the metrics middleware")
+    parser.add_argument("--requests", type=int, default=100_000)
+    asyncio.run(run(parser.parse_args().requests))
+
+
+if __name__ == "__main__":
+    main()
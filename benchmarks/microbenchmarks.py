@@ -0,0 +1,324 @@
+"""
+Microbenchmarks of hot helpers, serializers and controllers, against stored baselines.
+
+Everything runs in process, the database ones against an in-memory SQLite
+database, so no server is needed. Each benchmark keeps the best of a few
+timed rounds, and the results are compared with benchmarks/baseline.json:
+
+    python benchmarks/microbenchmarks.py                 # compare, exit 1 on a regression
+    python benchmarks/microbenchmarks.py --save          # store the results as the new baseline
+    python benchmarks/microbenchmarks.py -k summary      # only the benchmarks matching "summary"
+
+A benchmark regresses when it is more than --threshold (20% by default)
+slower than its baseline, after being timed again --retries times to rule
+out a busy machine. Timings depend on the machine, so the baseline must
+be saved on the one the comparisons run on. Against a baseline saved on
+another machine, or another Python, the results are printed but don't fail.
+"""
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi_azure_auth.user import User as AzureUser
+from starlette.requests import Request
+from tortoise import Tortoise
+from archive import decode_archive, encode_archive
+from cache import exercise_catalog, get_cache
+from controllers import (
+    get_authenticated_user,
+    get_user_exercises,
+    get_user_workout_plans,
+    summarize_exercise_logs,
+)
+from helpers import get_weeks_in_month, is_closed_month
+from ratelimit import set_rate_limiter
+from models import Exercise, ExerciseLog, ExerciseSummary, User, WorkoutPlan, WorkoutSession
+from schemas import Exercise_Pydantic, ExerciseLog_Pydantic, ExerciseSummary_Pydantic
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+ROUND_SECONDS = 0.2  # each timed round runs the benchmark about this long
+USER_ID = "benchmark-user"
+
+# name -> function returning the callable to time, sync or async
+BENCHMARKS = {}
+
+
+def machine_id() -> str:
+    """
+    Describe the machine the timings were taken on, enough to tell baselines from another apart.
+
+    :return: The architecture, CPU model, CPU count and Python version.
+    """
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            cpu = next(line.split(":", 1)[1].strip() for line in cpuinfo if line.startswith("model name"))
+    except (OSError, StopIteration):
+        pass
+    return f"{platform.machine()} {cpu} x{os.cpu_count()}, Python {platform.python_version()}"
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+async def create_fixtures() -> dict:
+    """
+    Create a user with a catalog, plans, sessions and logs in the SQLite database.
+    """
+    rng = random.Random(1)
+    user = await User.create(object_id=USER_ID)
+    for n in range(5):
+        await WorkoutPlan.create(user=user, name=f"plan {n}", description="benchmark plan")
+    exercises = [
+        await Exercise.create(
+            user=user, name=f"exercise {n}", description="benchmark exercise",
+            category="strength", muscle_group="chest",
+        )
+        for n in range(20)
+    ]
+    now = datetime.now(timezone.utc)
+    for n in range(20):
+        session = await WorkoutSession.create(user=user, date=now - timedelta(days=n), comments="")
+        for _ in range(5):
+            log = await ExerciseLog.create(
+                user=user, workout_session=session, date=session.date, exercise=rng.choice(exercises),
+                sets=rng.randint(1, 6), reps=rng.randint(1, 15), intensity=80, exertion_scale=7,
+            )
+            summary = await ExerciseSummary.create(
+                user=user, exercise_log=log, total_sets=log.sets, total_reps=log.reps, total_holds=log.reps
+            )
+    return {"user": user, "exercise": exercises[0], "log": log, "summary": summary}
+
+
+def auth_request() -> Request:
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "state": {}})
+    request.state.user = AzureUser(
+        claims={}, preferred_username="BenchmarkUser", roles=[], aud="aud", tid="tid",
+        access_token="123", is_guest=False, iat=1537231048, nbf=1537231048, exp=1537234948,
+        iss="iss", aio="aio", sub=USER_ID, oid="oid", uti="uti", rh="rh", ver="2.0",
+    )
+    return request
+
+
+@benchmark("helpers.get_weeks_in_month")
+def bench_weeks_in_month(fixtures):
+    return lambda: get_weeks_in_month(2024, 3)
+
+
+@benchmark("helpers.is_closed_month")
+def bench_is_closed_month(fixtures):
+    today = date(2024, 6, 15)
+    return lambda: is_closed_month(2024, 3, today)
+
+
+@benchmark("summary.summarize_exercise_logs[1000]")
+def bench_summarize(fixtures):
+    rng = random.Random(1)
+    logs = [(rng.randint(1, 6), rng.randint(1, 15)) for _ in range(1000)]
+    return lambda: summarize_exercise_logs(logs)
+
+
+@benchmark("summary.jsonable_encoder[month]")
+def bench_encode_month(fixtures):
+    weeks = get_weeks_in_month(2024, 3)
+    summary = [
+        {"week_start": week_start, "total_sets": 30, "total_reps": 240, "total_holds": 240}
+        for week_start, _ in weeks
+    ]
+    return lambda: jsonable_encoder(summary)
+
+
+@benchmark("serializers.ExerciseSummary_Pydantic")
+def bench_summary_serializer(fixtures):
+    summary = fixtures["summary"]
+    return lambda: ExerciseSummary_Pydantic.model_validate(summary).model_dump()
+
+
+@benchmark("serializers.ExerciseLog_Pydantic")
+def bench_log_serializer(fixtures):
+    log = fixtures["log"]
+    return lambda: ExerciseLog_Pydantic.model_validate(log).model_dump()
+
+
+@benchmark("serializers.Exercise_Pydantic")
+def bench_exercise_serializer(fixtures):
+    exercise = fixtures["exercise"]
+    return lambda: Exercise_Pydantic.model_validate(exercise).model_dump()
+
+
+@benchmark("archive.encode_decode[100 logs]")
+def bench_archive(fixtures):
+    now = datetime.now(timezone.utc)
+    logs = [
+        {
+            "id": n, "user_id": USER_ID, "workout_session_id": n // 5, "date": now, "exercise_id": 1,
+            "sets": 3, "reps": 8, "intensity": 80, "exertion_scale": 7,
+        }
+        for n in range(100)
+    ]
+    return lambda: decode_archive(encode_archive({"exercise_logs": logs}))
+
+
+@benchmark("controllers.get_authenticated_user")
+def bench_authenticated_user(fixtures):
+    request = auth_request()
+    return lambda: get_authenticated_user(request)
+
+
+@benchmark("controllers.get_user_workout_plans")
+def bench_workout_plans(fixtures):
+    user = fixtures["user"]
+    return lambda: get_user_workout_plans(user)
+
+
+@benchmark("controllers.get_user_exercises[cached]")
+def bench_exercises(fixtures):
+    user = fixtures["user"]
+    return lambda: get_user_exercises(user)
+
+
+async def call_many(function, is_async: bool, calls: int) -> float:
+    started = time.perf_counter()
+    if is_async:
+        for _ in range(calls):
+            await function()
+    else:
+        for _ in range(calls):
+            function()
+    return time.perf_counter() - started
+
+
+async def time_benchmark(function, repeat: int, round_seconds: float = ROUND_SECONDS) -> float:
+    """
+    Time a benchmark's callable, in seconds per call, the best of `repeat` rounds.
+
+    The garbage collector is off while timing, like in timeit.
+    """
+    is_async = inspect.iscoroutine(result := function())
+    if is_async:
+        await result
+    # calibrate the calls per round, which also warms up the caches
+    calls = 1
+    while (elapsed := await call_many(function, is_async, calls)) < round_seconds / 10:
+        calls *= 2
+    calls = max(1, int(calls * round_seconds / max(elapsed, 1e-9)))
+    gc.disable()
+    try:
+        return min([await call_many(function, is_async, calls) for _ in range(repeat)]) / calls
+    finally:
+        gc.enable()
+
+
+def is_regression(seconds: float, baseline: float | None, threshold: float) -> bool:
+    return baseline is not None and seconds / baseline - 1 > threshold
+
+
+async def run(args: argparse.Namespace, baseline: dict[str, float]) -> dict[str, float]:
+    """
+    Run the selected benchmarks, timing again those that look like regressions.
+
+    A slow round on a busy machine then doesn't fail the comparison, the best time is kept.
+    """
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["models"]})
+    await Tortoise.generate_schemas()
+    await get_cache().clear()
+    exercise_catalog.clear()
+    # the benchmarks call the controllers far faster than any user, they'd time 429s
+    set_rate_limiter(None)
+    try:
+        fixtures = await create_fixtures()
+        results = {}
+        for name, setup in BENCHMARKS.items():
+            if args.k and args.k not in name:
+                continue
+            results[name] = await time_benchmark(setup(fixtures), args.repeat, args.round_seconds)
+        for _ in range(0 if args.save else args.retries):
+            slow = [
+                name for name, seconds in results.items()
+                if is_regression(seconds, baseline.get(name), args.threshold)
+            ]
+            for name in slow:
+                seconds = await time_benchmark(BENCHMARKS[name](fixtures), args.repeat, args.round_seconds)
+                results[name] = min(results[name], seconds)
+    finally:
+        await Tortoise.close_connections()
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    """
+    Print the results next to the baseline.
+
+    :return: The names of the benchmarks slower than the baseline by more than the threshold.
+    """
+    regressions = []
+    print(f"{'benchmark':<44} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<44} {'-':>12} {seconds * 1e6:>10.2f}µs {'new':>8}")
+            continue
+        change = seconds / before - 1
+        regressed = is_regression(seconds, before, threshold)
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<44} {before * 1e6:>10.2f}µs {seconds * 1e6:>10.2f}µs {change:>+7.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the microbenchmarks against the stored baseline")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--repeat", type=int, default=7, help="timed rounds per benchmark")
+    parser.add_argument("--retries", type=int, default=2, help="times a regressed benchmark is timed again")
+    parser.add_argument("--round-seconds", type=float, default=ROUND_SECONDS, help="length of a timed round")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("-k", help="only run the benchmarks whose name contains this")
+    args = parser.parse_args()
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else {"results": {}}
+    results = asyncio.run(run(args, stored["results"]))
+
+    if args.save:
+        if stored.get("machine") == machine_id():
+            results = {**stored["results"], **results}
+        elif stored["results"]:
+            # timings of another machine aren't kept under this one's name
+            print(f"Replacing the baseline saved on {stored.get('machine', 'an unknown machine')}")
+        stored = {"machine": machine_id(), "results": results}
+        args.baseline.write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n")
+        print(f"Saved {len(results)} results to {args.baseline}")
+        return
+    regressions = compare(results, stored["results"], args.threshold)
+    if stored.get("machine") != machine_id():
+        print(
+            f"The baseline was saved on {stored.get('machine', 'an unknown machine')}, "
+            f"this is {machine_id()}: the timings aren't comparable, save a baseline here with --save"
+        )
+    elif regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Seed the database of TORTOISE_ORM with synthetic users for load tests, through COPY.
+
+Each user gets workout plans, an exercise catalog, sessions spread over the
+last two years and exercise logs with their summaries:
+
+    python benchmarks/seed.py --users 10000 --logs 10000000
+    python benchmarks/seed.py --clean
+
+Users are named `<prefix><n>`, run with --clean to delete them again.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tortoise import Tortoise, run_async
+from database import TORTOISE_ORM
+
+MUSCLE_GROUPS = ("chest", "back", "legs", "shoulders", "arms", "core")
+CATEGORIES = ("strength", "hypertrophy", "endurance", "mobility")
+PLANS_PER_USER = 2
+EXERCISES_PER_USER = 8
+LOGS_PER_SESSION = 5
+HISTORY_DAYS = 730
+USERS_PER_BATCH = 100
+
+COLUMNS = {
+    "user": ("object_id",),
+    "workoutplan": ("id", "user_id", "name", "description"),
+    "exercise": ("id", "user_id", "name", "description", "category", "muscle_group"),
+    "workoutsession": ("id", "user_id", "date", "comments"),
+    "exerciselog": (
+        "id", "user_id", "workout_session_id", "date", "exercise_id",
+        "sets", "reps", "intensity", "exertion_scale",
+    ),
+    "exercisesummary": ("id", "user_id", "exercise_log_id", "total_sets", "total_reps", "total_holds"),
+}
+
+
+class IdSequence:
+    """
+    Hands out IDs after the current maximum of a table, the sequence is moved past them at the end.
+    """
+
+    def __init__(self, start: int):
+        self.last = start
+
+    def next(self) -> int:
+        self.last += 1
+        return self.last
+
+
+def user_rows(user_id: str, logs: int, ids: dict[str, IdSequence], rng: random.Random, now: datetime) -> dict:
+    rows = {table: [] for table in COLUMNS}
+    rows["user"].append((user_id,))
+    for n in range(PLANS_PER_USER):
+        rows["workoutplan"].append((ids["workoutplan"].next(), user_id, f"plan {n}", "synthetic plan"))
+    exercise_ids = []
+    for n in range(EXERCISES_PER_USER):
+        exercise_ids.append(ids["exercise"].next())
+        rows["exercise"].append(
+            (exercise_ids[-1], user_id, f"exercise {n}", "synthetic exercise",
+             rng.choice(CATEGORIES), rng.choice(MUSCLE_GROUPS))
+        )
+    sessions = max(1, logs // LOGS_PER_SESSION)
+    for n in range(sessions):
+        session_id = ids["workoutsession"].next()
+        session_date = now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 24 * 3600))
+        rows["workoutsession"].append((session_id, user_id, session_date, "synthetic session"))
+        for _ in range(LOGS_PER_SESSION if n < sessions - 1 else logs - LOGS_PER_SESSION * (sessions - 1)):
+            log_id = ids["exerciselog"].next()
+            sets, reps = rng.randint(1, 6), rng.randint(1, 15)
+            rows["exerciselog"].append(
+                (log_id, user_id, session_id, session_date, rng.choice(exercise_ids),
+                 sets, reps, rng.randint(40, 100), rng.randint(1, 10))
+            )
+            rows["exercisesummary"].append(
+                (ids["exercisesummary"].next(), user_id, log_id, sets, reps, reps)
+            )
+    return rows
+
+
+async def seed(users: int, logs: int, prefix: str, seed_value: int) -> None:
+    client = Tortoise.get_connection("default")
+    ids = {}
+    for table in COLUMNS:
+        if "id" in COLUMNS[table]:
+            _, rows = await client.execute_query(f'SELECT coalesce(max("id"), 0) AS "id" FROM "{table}"')
+            ids[table] = IdSequence(rows[0]["id"])
+    rng = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+    logs_per_user, extra_logs = divmod(logs, users)
+    started = time.perf_counter()
+    async with client.acquire_connection() as connection:
+        for batch_start in range(0, users, USERS_PER_BATCH):
+            batch = {table: [] for table in COLUMNS}
+            for n in range(batch_start, min(batch_start + USERS_PER_BATCH, users)):
+                user_logs = logs_per_user + (1 if n < extra_logs else 0)
+                for table, rows in user_rows(f"{prefix}{n}", user_logs, ids, rng, now).items():
+                    batch[table].extend(rows)
+            async with connection.transaction():
+                for table, rows in batch.items():
+                    await connection.copy_records_to_table(table, records=rows, columns=COLUMNS[table])
+            done = min(batch_start + USERS_PER_BATCH, users)
+            print(f"\r{done}/{users} users, {time.perf_counter() - started:.0f}s", end="", flush=True)
+        for table, sequence in ids.items():
+            await connection.execute(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), {max(sequence.last, 1)})"
+            )
+        await connection.execute("ANALYZE")
+    print(f"\nSeeded {users} users and {logs} exercise logs in {time.perf_counter() - started:.1f}s")
+
+
+async def clean(prefix: str) -> None:
+    # everything else goes with the users
+    deleted, _ = await Tortoise.get_connection("default").execute_query(
+        'DELETE FROM "user" WHERE "object_id" LIKE $1', [prefix.replace("%", r"\%") + "%"]
+    )
+    print(f"Deleted {deleted} users")
+
+
+async def run(args: argparse.Namespace) -> None:
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        if args.clean:
+            await clean(args.prefix)
+        else:
+            await seed(args.users, args.logs, args.prefix, args.seed)
+    finally:
+        await Tortoise.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed synthetic users for load tests")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--logs", type=int, default=10_000_000, help="exercise logs in total")
+    parser.add_argument("--prefix", default="load-user-")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--clean", action="store_true", help="delete the seeded users instead")
+    run_async(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
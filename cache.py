@@ -0,0 +1,525 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any
+from models import Exercise, MonthlySummary
+from helpers import is_closed_month
+from jobs import enqueue
+from settings import settings
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # only needed for CACHE_BACKEND="redis"
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Counters in redis outlive every cached value read before their last increment
+COUNTER_TTL = 24 * 60 * 60
+
+
+class CacheBackend:
+    """
+    Interface of the response cache backends. Values must be JSON serializable.
+    """
+
+    hits = 0
+    misses = 0
+
+    def count(self, value: Any | None) -> Any | None:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def get(self, key: str) -> Any | None:
+        return self.count(await self.peek(key))
+
+    async def peek(self, key: str) -> Any | None:
+        """
+        Read a value without counting the lookup, for keys that aren't cached responses.
+
+        :param key: The key.
+        :return: The value, None if missing or expired.
+        """
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        """
+        Increment a counter, e.g. a generation, shared like the cached values.
+
+        :param key: The counter's key.
+        :return: The new value.
+        """
+        raise NotImplementedError
+
+    async def get_counter(self, key: str) -> int:
+        """
+        Read a counter, without counting as a cache lookup.
+
+        :param key: The counter's key.
+        :return: The value, 0 for a counter never incremented.
+        """
+        raise NotImplementedError
+
+
+class Counters:
+    """
+    Per process counters, the most recently incremented `max_counters` are kept.
+    Dropped counters all read the highest value dropped, so a reader comparing
+    a value from before sees a change rather than missing one.
+    """
+
+    def __init__(self, max_counters: int = None):
+        self.max_counters = max_counters or settings.CACHE_MAX_ENTRIES
+        self._counters: OrderedDict[str, int] = OrderedDict()
+        self._dropped = 0
+
+    def get(self, key: str) -> int:
+        return self._counters.get(key, self._dropped)
+
+    def incr(self, key: str) -> int:
+        # above every dropped value, so a dropped and recreated counter still changes
+        value = max(self.get(key), self._dropped) + 1
+        self._counters[key] = value
+        self._counters.move_to_end(key)
+        while len(self._counters) > self.max_counters:
+            _, dropped = self._counters.popitem(last=False)
+            self._dropped = max(self._dropped, dropped)
+        return value
+
+    def clear(self) -> None:
+        self._counters.clear()
+
+
+class NullCache(CacheBackend):
+    """
+    Caches nothing, every read is recomputed. Counters are kept per process.
+    """
+
+    def __init__(self):
+        self._counters = Counters()
+
+    async def incr(self, key):
+        return self._counters.incr(key)
+
+    async def get_counter(self, key):
+        return self._counters.get(key)
+
+    async def peek(self, key):
+        return None
+
+    async def set(self, key, value, ttl=None):
+        pass
+
+    async def delete(self, *keys):
+        pass
+
+    async def clear(self):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """
+    Per process LRU cache with expiry.
+
+    Writes only evict the entries of the process they went through, the TTL
+    bounds how stale the other workers can be. Use a shared backend with
+    several workers.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.max_entries = max_entries or settings.CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.CACHE_TTL
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._counters = Counters(self.max_entries)
+
+    async def peek(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl=None):
+        self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+    async def incr(self, key):
+        return self._counters.incr(key)
+
+    async def get_counter(self, key):
+        return self._counters.get(key)
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the subset of the `redis.asyncio` client RedisCache uses,
+    for tests and single process development.
+    """
+
+    def __init__(self):
+        self._data: dict[str, tuple[float | None, bytes]] = {}
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            self._data.pop(key, None)
+            return None
+        return entry[1]
+
+    async def set(self, key, value, ex=None):
+        expires = time.monotonic() + ex if ex is not None else None
+        self._data[key] = (expires, value if isinstance(value, bytes) else str(value).encode())
+
+    async def delete(self, *keys):
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def incr(self, key):
+        entry = self._data.get(key)
+        value = int(await self.get(key) or 0) + 1
+        self._data[key] = (entry[0] if entry else None, str(value).encode())
+        return value
+
+    async def expire(self, key, seconds):
+        if key in self._data:
+            self._data[key] = (time.monotonic() + seconds, self._data[key][1])
+
+    async def scan_iter(self, match=None):
+        prefix = match.rstrip("*") if match else ""
+        for key in list(self._data):
+            if key.startswith(prefix):
+                yield key
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache shared by all the workers, in redis.
+
+    Cache failures are logged and treated as misses, the database stays the source of truth.
+    """
+
+    def __init__(self, client=None, ttl: float = None, prefix: str = "repitup:"):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("CACHE_BACKEND=redis needs the redis package installed")
+            client = redis.from_url(settings.CACHE_URL)
+        self.client = client
+        self.ttl = ttl if ttl is not None else settings.CACHE_TTL
+        self.prefix = prefix
+
+    async def peek(self, key):
+        try:
+            data = await self.client.get(self.prefix + key)
+        except Exception:
+            logger.exception("Cache read of %s failed", key)
+            return None
+        return None if data is None else json.loads(data)
+
+    async def set(self, key, value, ttl=None):
+        try:
+            await self.client.set(
+                self.prefix + key,
+                json.dumps(value, separators=(",", ":")),
+                ex=max(1, int(ttl if ttl is not None else self.ttl)),
+            )
+        except Exception:
+            logger.exception("Cache write of %s failed", key)
+
+    async def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            await self.client.delete(*(self.prefix + key for key in keys))
+        except Exception:
+            logger.exception("Cache eviction of %s failed", keys)
+
+    async def incr(self, key):
+        try:
+            value = await self.client.incr(self.prefix + key)
+            await self.client.expire(self.prefix + key, COUNTER_TTL)
+            return value
+        except Exception:
+            logger.exception("Cache increment of %s failed", key)
+            return 0
+
+    async def get_counter(self, key):
+        try:
+            return int(await self.client.get(self.prefix + key) or 0)
+        except Exception:
+            logger.exception("Cache read of %s failed", key)
+            # a value no increment returns, so a comparison with it fails
+            return -1
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*")]
+        if keys:
+            await self.client.delete(*keys)
+
+
+def create_cache(backend: str = None) -> CacheBackend:
+    """
+    Create the cache backend named in the settings.
+
+    :param backend: `memory`, `redis`, `local-redis` or `none`, defaults to CACHE_BACKEND.
+    :return: The backend.
+    """
+    backend = backend or settings.CACHE_BACKEND
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "redis":
+        return RedisCache()
+    if backend == "local-redis":
+        return RedisCache(LocalRedis())
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+cache = create_cache()
+
+
+def set_cache(backend: CacheBackend) -> None:
+    """
+    Replace the cache backend, e.g. in tests.
+
+    :param backend: The new backend.
+    :return: None
+    """
+    global cache
+    cache = backend
+
+
+def get_cache() -> CacheBackend:
+    return cache
+
+
+def summary_month_key(user_id: str, year: int, month: int) -> str:
+    return f"summary:{user_id}:month:{year:04d}-{month:02d}"
+
+
+def summary_log_key(user_id: str, exercise_log_id: int) -> str:
+    return f"summary:{user_id}:log:{exercise_log_id}"
+
+
+def summary_generation_key(user_id: str) -> str:
+    return f"summary:{user_id}:generation"
+
+
+async def get_summary_generation(user_id: str) -> int:
+    """
+    Get the count of a user's summary invalidations, kept in the cache backend so all workers share it.
+
+    Read it before a summary, and pass it to `set_summary`.
+
+    :param user_id: The ID of the user.
+    :return: The generation.
+    """
+    return await cache.get_counter(summary_generation_key(user_id))
+
+
+async def set_summary(key: str, user_id: str, generation: int, value: Any) -> None:
+    """
+    Cache a summary, unless the user's summaries were invalidated since it was read.
+
+    :param key: The cache key.
+    :param user_id: The ID of the user.
+    :param generation: `get_summary_generation(user_id)` from before the summary was read.
+    :param value: The summary.
+    :return: None
+    """
+    if await get_summary_generation(user_id) == generation:
+        await cache.set(key, value)
+
+
+async def invalidate_summaries(
+    user_id: str, dates: list[date | datetime] = (), exercise_log_ids: list[int] = ()
+) -> None:
+    """
+    Evict the cached summaries a write affects, stored ones of closed months included.
+
+    A log counts in the week starting up to 6 days before it, and that week
+    may belong to the previous month's summary.
+
+    :param user_id: The ID of the user who wrote.
+    :param dates: The dates of the written exercise logs, before and after the write.
+    :param exercise_log_ids: The exercise logs whose summary changed.
+    :return: None
+    """
+    await cache.incr(summary_generation_key(user_id))
+    months = set()
+    for day in dates:
+        if day is None:
+            continue
+        for affected in (day, day - timedelta(days=6)):
+            months.add(date(affected.year, affected.month, 1))
+    keys = {summary_month_key(user_id, month.year, month.month) for month in months}
+    keys.update(summary_log_key(user_id, exercise_log_id) for exercise_log_id in exercise_log_ids)
+    await cache.delete(*keys)
+    # a backdated write, the stored summaries of closed months are recomputed in the background
+    closed_months = [month for month in months if is_closed_month(month.year, month.month)]
+    if closed_months:
+        await MonthlySummary.filter(user_id=user_id, month__in=closed_months).delete()
+        for month in closed_months:
+            await enqueue(
+                "rebuild_monthly_summary",
+                {"user_id": user_id, "year": month.year, "month": month.month},
+                key=f"rebuild_monthly_summary:{user_id}:{month.isoformat()}",
+            )
+
+
+class ExerciseCatalogCache:
+    """
+    Per process cache of each user's exercises, least recently used users are dropped.
+
+    The exercise controllers write through it. A catalog loaded while a write of
+    the same user was in flight is not kept, and catalogs expire after
+    CATALOG_CACHE_TTL so writes through other workers are picked up.
+    """
+
+    COLUMNS = ("id", "name", "description", "category", "muscle_group")
+
+    def __init__(self, max_users: int = None, ttl: float = None):
+        self.max_users = max_users or settings.CATALOG_CACHE_MAX_USERS
+        self.ttl = ttl if ttl is not None else settings.CATALOG_CACHE_TTL
+        self._catalogs: OrderedDict[str, tuple[float, dict[int, dict]]] = OrderedDict()
+        self._loading: dict[str, int] = {}
+        self._versions: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_catalog(self, user_id: str) -> dict[int, dict]:
+        """
+        Get a user's exercises by ID, loading them on a miss.
+
+        :param user_id: The ID of the user.
+        :return: The exercises, as dicts of COLUMNS. Not to be mutated.
+        """
+        entry = self._catalogs.get(user_id)
+        if entry is not None and entry[0] >= time.monotonic():
+            self.hits += 1
+            self._catalogs.move_to_end(user_id)
+            return entry[1]
+        self.misses += 1
+        # writes only bump the version of users with a load in flight
+        self._loading[user_id] = self._loading.get(user_id, 0) + 1
+        version = self._versions.get(user_id, 0)
+        try:
+            exercises = await Exercise.filter(user_id=user_id).order_by("id").values(*self.COLUMNS)
+        finally:
+            written = self._versions.get(user_id, 0) != version
+            self._loading[user_id] -= 1
+            if not self._loading[user_id]:
+                del self._loading[user_id]
+                self._versions.pop(user_id, None)
+        catalog = {exercise["id"]: exercise for exercise in exercises}
+        if not written:
+            self._catalogs[user_id] = (time.monotonic() + self.ttl, catalog)
+            self._catalogs.move_to_end(user_id)
+            while len(self._catalogs) > self.max_users:
+                self._catalogs.popitem(last=False)
+        return catalog
+
+    async def get_exercise(self, user_id: str, exercise_id: int) -> dict | None:
+        return (await self.get_catalog(user_id)).get(exercise_id)
+
+    async def owns(self, user_id: str, exercise_id: int, verify: bool = False) -> bool:
+        """
+        Check a user owns an exercise.
+
+        The catalog may be CATALOG_CACHE_TTL old, so a miss is checked against the
+        database, the exercise may have been created through another worker. With
+        `verify` the database is asked either way, for writes referencing the
+        exercise, which may have been deleted through another worker.
+
+        :param user_id: The ID of the user.
+        :param exercise_id: The ID of the exercise.
+        :param verify: Skip the catalog.
+        :return: Whether the exercise exists and is the user's.
+        """
+        if not verify and exercise_id in await self.get_catalog(user_id):
+            return True
+        return await Exercise.exists(id=exercise_id, user_id=user_id)
+
+    def _written(self, user_id: str) -> None:
+        # a load in flight may have read before the write, it isn't kept
+        if user_id in self._loading:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def put(self, user_id: str, exercise) -> None:
+        """
+        Write a created or updated exercise through to the user's cached catalog, if any.
+
+        :param user_id: The ID of the owner.
+        :param exercise: The Exercise.
+        :return: None
+        """
+        self._written(user_id)
+        entry = self._catalogs.get(user_id)
+        if entry is not None:
+            catalog = dict(entry[1])
+            catalog[exercise.id] = {column: getattr(exercise, column) for column in self.COLUMNS}
+            self._catalogs[user_id] = (entry[0], catalog)
+
+    def remove(self, user_id: str, exercise_id: int) -> None:
+        self._written(user_id)
+        entry = self._catalogs.get(user_id)
+        if entry is not None:
+            catalog = {id: exercise for id, exercise in entry[1].items() if id != exercise_id}
+            self._catalogs[user_id] = (entry[0], catalog)
+
+    def clear(self) -> None:
+        self._catalogs.clear()
+        for user_id in self._loading:
+            self._written(user_id)
+
+    def stats(self) -> dict:
+        """
+        Get the hit rate of the cache since the process started.
+
+        :return: The hits, misses, hit rate and number of cached users.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "users": len(self._catalogs),
+            "max_users": self.max_users,
+        }
+
+
+exercise_catalog = ExerciseCatalogCache()
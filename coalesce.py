@@ -0,0 +1,136 @@
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Hashable
+from tortoise.models import Model
+from db_router import reads_from_primary
+from models import User
+
+
+class SingleFlight:
+    """
+    Shares one in-flight computation between concurrent identical calls.
+
+    The first caller of a key starts the computation as a task, callers arriving
+    while it runs await the same task and get its result or exception. A caller
+    being cancelled doesn't cancel the others, the task is only cancelled once
+    all its callers are gone. Nothing is kept once the task is done.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, tuple[asyncio.Task, list[int]]] = {}
+        self._user_keys: dict[str, set[Hashable]] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, user_id: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `compute`, or join the computation of the same key already running.
+
+        :param key: What identifies identical calls.
+        :param user_id: The user the call reads for, their writes end the sharing.
+        :param compute: Starts the computation.
+        :return: The result of the computation.
+        """
+        self.calls += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(compute())
+            flight = (task, [0])
+            self._flights[key] = flight
+            self._user_keys.setdefault(user_id, set()).add(key)
+            task.add_done_callback(lambda _: self._land(key, user_id, flight))
+        else:
+            self.shared += 1
+        task, waiters = flight
+        waiters[0] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and waiters[0] == 1:
+                # the last caller is gone, callers from now on start over
+                self._drop(key, user_id, flight)
+                task.cancel()
+            raise
+        finally:
+            waiters[0] -= 1
+
+    def _drop(self, key: Hashable, user_id: str, flight: tuple) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            keys = self._user_keys.get(user_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._user_keys[user_id]
+
+    def _land(self, key: Hashable, user_id: str, flight: tuple) -> None:
+        self._drop(key, user_id, flight)
+        task = flight[0]
+        if not task.cancelled():
+            task.exception()  # retrieved, a failure no caller awaited isn't logged as unhandled
+
+    def forget(self, user_id: str) -> None:
+        """
+        Stop sharing the user's running computations, calls from now on start new ones.
+
+        Called after a write of the user, so reads started before it aren't served after it.
+
+        :param user_id: The ID of the user.
+        :return: None
+        """
+        for key in self._user_keys.pop(user_id, ()):
+            self._flights.pop(key, None)
+
+    def stats(self) -> dict:
+        """
+        Get how many calls were served by another call's computation.
+
+        :return: The calls, the shared ones and their ratio, and the computations running.
+        """
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "shared_rate": self.shared / self.calls if self.calls else 0.0,
+            "in_flight": len(self._flights),
+        }
+
+
+single_flight = SingleFlight()
+
+
+def to_key(value: Any) -> Hashable:
+    if isinstance(value, Model):
+        return (type(value).__name__, value.pk)
+    if isinstance(value, (list, dict, set)):
+        return repr(value)
+    return value
+
+
+def coalesce(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Make concurrent identical calls of a controller share one computation.
+
+    Calls are identical when they have the same arguments, models compare by
+    primary key, and read from the same database. The controller must take the User it reads for, and callers
+    get the same result object so must not mutate it.
+
+    :param func: The controller.
+    :return: The coalescing controller.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        user = next(
+            (value for value in (*args, *kwargs.values()) if isinstance(value, User)), None
+        )
+        if user is None:
+            return await func(*args, **kwargs)
+        key = (
+            func.__qualname__,
+            reads_from_primary(),
+            tuple(to_key(value) for value in args),
+            tuple(sorted((name, to_key(value)) for name, value in kwargs.items())),
+        )
+        return await single_flight.do(key, user.pk, lambda: func(*args, **kwargs))
+
+    return wrapper
@@ -1,30 +1,114 @@
 import pytest
+import time
+from contextlib import contextmanager
 from httpx import AsyncClient, ASGITransport
 from project import app as fastapi_app
 from fastapi import Request
 from fastapi_azure_auth.user import User
 from project import azure_scheme
-from tortoise.contrib.test import finalizer, initializer
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
 import asgi_lifespan
 from project import app
-from models import ExerciseLog, ExerciseSummary
+from database import TORTOISE_ORM_TEST, TORTOISE_ORM_TEST_SQLITE, generate_replica_schemas
+from models import ExerciseLog, ExerciseSummary, WorkoutSession
+from cache import exercise_catalog, get_cache
+from querystats import track_queries
+from ratelimit import set_rate_limiter
+
+
+class Rollback(Exception):
+    """Raised to end a test's transaction with a rollback."""
+
+
+# reported at the end of the run
+database_timings = {"backend": None, "setup_seconds": 0.0, "session_started": 0.0}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--sqlite",
+        action="store_true",
+        help="run against an in-memory SQLite database, the tests marked postgres are skipped",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: needs Postgres, skipped with --sqlite")
+    config.addinivalue_line(
+        "markers", "commits: runs outside the rolled back transaction, e.g. it uses several connections at once"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if not config.getoption("--sqlite"):
+        return
+    skip = pytest.mark.skip(reason="needs Postgres")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_sessionstart(session):
+    database_timings["session_started"] = time.perf_counter()
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if database_timings["backend"] is not None:
+        terminalreporter.write_line(
+            f"{database_timings['backend']} test database set up in {database_timings['setup_seconds']:.2f}s, "
+            f"tests ran in {time.perf_counter() - database_timings['session_started']:.2f}s wall time"
+        )
 
 
 @pytest.fixture(scope="session", autouse=True)
 def initialize_tests(request):
     app.state.testing = True
-    # db_url = "sqlite://:memory"  # Use in-memory SQLite for tests
-    # initializer(["models"], db_url=db_url, app_label="models")
-    # request.addfinalizer(finalizer)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def anyio_backend():
     return "asyncio"
 
 
+@pytest.fixture(scope="session")
+async def database(request):
+    """
+    Connect to the test database and create the schema, once for the whole session.
+    """
+    started = time.perf_counter()
+    sqlite = request.config.getoption("--sqlite")
+    config = TORTOISE_ORM_TEST_SQLITE if sqlite else TORTOISE_ORM_TEST
+    await Tortoise.init(config=config)
+    await Tortoise.generate_schemas()
+    if "replica" in config["connections"]:
+        await generate_replica_schemas()
+    database_timings["backend"] = "sqlite" if sqlite else "postgres"
+    database_timings["setup_seconds"] = time.perf_counter() - started
+    yield config
+    await Tortoise.close_connections()
+
+
+@pytest.fixture
+async def db(request, database):
+    """
+    Run the test in a transaction rolled back at the end, so it leaves nothing behind.
+
+    Tests marked `commits` run without it.
+    """
+    if request.node.get_closest_marker("commits"):
+        yield None
+        return
+    try:
+        async with in_transaction("default") as connection:
+            yield connection
+            raise Rollback
+    except Rollback:
+        pass
+
+
 @pytest.fixture
-async def normal_user_client():
+async def normal_user_client(db):
     async def mock_normal_user(request: Request):
         user = User(
             claims={},
@@ -49,6 +133,11 @@ async def normal_user_client():
         return user
 
     fastapi_app.dependency_overrides[azure_scheme] = mock_normal_user
+    # fixtures write through the ORM, bypassing the cache invalidation
+    await get_cache().clear()
+    exercise_catalog.clear()
+    # tests send requests faster than users, test_rate_limits installs its own limiter
+    set_rate_limiter(None)
     async with asgi_lifespan.LifespanManager(fastapi_app) as manager:
         transport = ASGITransport(app=manager.app)
         async with AsyncClient(transport=transport, base_url="http://test") as ac:
@@ -117,8 +206,11 @@ async def created_exercise_log_id(
 
 @pytest.fixture
 async def created_exercise_summary_id(created_workout_session_id, created_exercise_id):
+    workout_session_obj = await WorkoutSession.get(id=created_workout_session_id)
     exercise_log_obj = await ExerciseLog.create(
-        workout_session_id=created_workout_session_id,
+        user_id="sub",
+        workout_session=workout_session_obj,
+        date=workout_session_obj.date,
         exercise_id=created_exercise_id,
         sets=3,
         reps=6,
@@ -126,9 +218,26 @@ async def created_exercise_summary_id(created_workout_session_id, created_exerci
         exertion_scale=6,
     )
     exercise_summary_obj = await ExerciseSummary.create(
-        exercise_log_id=exercise_log_obj.id, total_sets=12, total_reps=18, total_holds=0
+        user_id="sub",
+        exercise_log_id=exercise_log_obj.id,
+        total_sets=12,
+        total_reps=18,
+        total_holds=0,
     )
 
     return int(exercise_summary_obj.id)
 
 
+@contextmanager
+def assert_max_queries(budget: int):
+    """
+    Fail the test if more than `budget` SQL statements run inside the block.
+
+    :param budget: The maximum number of statements.
+    :return: The stats of the statements, filled as they run.
+    """
+    with track_queries() as stats:
+        yield stats
+    assert stats.count <= budget, f"{stats.count} queries over a budget of {budget}:\n" + "\n".join(
+        query for query, _ in stats.queries
+    )
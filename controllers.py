@@ -1,28 +1,74 @@
 from fastapi import Request, HTTPException
+from fastapi.responses import StreamingResponse
 from models import *
 from schemas import *
-from datetime import datetime, timedelta
-from helpers import get_weeks_in_month
+from datetime import date, timedelta
+from helpers import get_weeks_in_month, is_closed_month
 from tortoise.exceptions import DoesNotExist
-
-
+from db_router import route_request
+from fastapi.encoders import jsonable_encoder
+from cache import (
+    exercise_catalog,
+    get_cache,
+    get_summary_generation,
+    invalidate_summaries,
+    set_summary,
+    summary_log_key,
+    summary_month_key,
+)
+from archive import (
+    filter_archived_rows,
+    find_archived_row,
+    get_archived_exercise_logs,
+    get_archived_rows,
+    to_utc_datetime,
+)
+from coalesce import coalesce
+from tracing import traced
+from analytics import exercise_progression, pack_exercise_logs, unpack_progression
+from offload import OffloadQueueFull, offload_pool
+from ratelimit import check_rate_limit
+from export import EXPORT_MEDIA_TYPES, EXPORT_TABLES, stream_user_table
+from jobs import job
+
+
+@traced
 async def get_authenticated_user(request: Request) -> User:
     """
     Extract and validate the authenticated user from the request.
+    Also applies the user's rate limit and picks the database connection the request reads from.
 
     :param request: The incoming request object.
     :type request: Request
     :return: The authenticated user object.
     :rtype: User
-    :raises HTTPException: If the user is unauthorized.
+    :raises HTTPException: If the user is unauthorized, or over their rate limit.
     """
     user_dict = request.state.user.model_dump()
     if not user_dict:
         raise HTTPException(status_code=401, detail="Unauthorized User")
+    # before the first query, a flood of requests doesn't reach the database
+    await check_rate_limit(user_dict["sub"], request.method)
+    await route_request(user_dict["sub"], request.method)
     user, _ = await User.get_or_create(object_id=user_dict["sub"])
     return user
 
 
+def archived_to_pydantic(pydantic_model, row: dict):
+    """
+    Convert a row read back from the archive to a response model, leaving out columns it lacks.
+
+    :param pydantic_model: The response model.
+    :param row: The archived row.
+    :return: The response model instance.
+    """
+    return pydantic_model.model_validate(
+        {field: row[field] for field in pydantic_model.model_fields if field in row}
+    )
+
+
+@traced
+@coalesce
 async def get_user_workout_plans(user: User) -> list[WorkoutPlanBase]:
     """
     Retrieve workout plans for a user.
@@ -41,6 +87,7 @@ async def get_user_workout_plans(user: User) -> list[WorkoutPlanBase]:
         )
 
 
+@traced
 async def get_user_workout_plan(id: int, user: User) -> WorkoutPlan:
     """
     Retrieve a specific workout plan for a user.
@@ -63,6 +110,7 @@ async def get_user_workout_plan(id: int, user: User) -> WorkoutPlan:
         )
 
 
+@traced
 async def create_user_workout_plan(
     user: User, workout: WorkoutPlanCreate
 ) -> WorkoutPlan:
@@ -84,6 +132,7 @@ async def create_user_workout_plan(
         )
 
 
+@traced
 async def update_user_workout_plan(
     id: int, user: User, workout: WorkoutPlanUpdate
 ) -> WorkoutPlan:
@@ -111,6 +160,7 @@ async def update_user_workout_plan(
         )
 
 
+@traced
 async def delete_user_workout_plan(id: int, user: User) -> None:
     """
     Deletes a workout plan for a user.
@@ -131,6 +181,8 @@ async def delete_user_workout_plan(id: int, user: User) -> None:
         )
 
 
+@traced
+@coalesce
 async def get_user_workout_sessions(user: User) -> list[WorkoutSessionBase]:
     """
     Retrieves all workout sessions for a user.
@@ -141,8 +193,19 @@ async def get_user_workout_sessions(user: User) -> list[WorkoutSessionBase]:
     :rtype: list
     """
     try:
-        workout_sessions = WorkoutSession.filter(user=user)
-        return await WorkoutSession_Pydantic_List.from_queryset(workout_sessions)
+        workout_sessions = await WorkoutSession_Pydantic_List.from_queryset(
+            WorkoutSession.filter(user=user)
+        )
+        archived_sessions = await get_archived_rows(user, "sessions")
+        if archived_sessions:
+            return WorkoutSession_Pydantic_List(
+                [
+                    archived_to_pydantic(WorkoutSession_Pydantic, session)
+                    for session in archived_sessions
+                ]
+                + workout_sessions.root
+            )
+        return workout_sessions
 
     except Exception as e:
         raise HTTPException(
@@ -150,6 +213,8 @@ async def get_user_workout_sessions(user: User) -> list[WorkoutSessionBase]:
         )
 
 
+@traced
+@coalesce
 async def get_user_workout_session(id: int, user: User) -> WorkoutSessionBase:
     """
     Retrieve a specific workout session for a user.
@@ -163,7 +228,13 @@ async def get_user_workout_session(id: int, user: User) -> WorkoutSessionBase:
     :rtype: WorkoutSession
     """
     try:
-        workout_sesssion_obj = await WorkoutSession.get(id=id, user=user)
+        workout_sesssion_obj = await WorkoutSession.get_or_none(id=id, user=user)
+        if workout_sesssion_obj is None:
+            # older sessions are read back from the archive
+            archived_session = await find_archived_row(user, "sessions", id=id)
+            if archived_session is None:
+                raise DoesNotExist("Workout Session not found")
+            return archived_to_pydantic(WorkoutSession_Pydantic, archived_session)
         return workout_sesssion_obj
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Workout Session not found")
@@ -173,6 +244,7 @@ async def get_user_workout_session(id: int, user: User) -> WorkoutSessionBase:
         )
 
 
+@traced
 async def create_user_workout_session(
     user: User, workout_session: WorkoutSessionCreate
 ) -> WorkoutSessionBase:
@@ -198,6 +270,7 @@ async def create_user_workout_session(
         )
 
 
+@traced
 async def update_user_workout_session(
     id: int, user: User, workout: WorkoutSessionUpdate
 ) -> WorkoutSessionBase:
@@ -216,10 +289,17 @@ async def update_user_workout_session(
     """
     try:
         workout_session_obj = await WorkoutSession.get(id=id, user=user)
+        previous_date = workout_session_obj.date
         workout_session = await workout_session_obj.update_from_dict(
             workout.model_dump(exclude_none=True)
         )
         await workout_session.save()
+        if workout.date is not None:
+            # keep the logs' denormalized date in step with their session
+            await ExerciseLog.filter(workout_session_id=id, user=user).update(
+                date=workout_session.date
+            )
+            await invalidate_summaries(user.pk, [previous_date, workout_session.date])
         return workout_session
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Workout session not found")
@@ -229,6 +309,7 @@ async def update_user_workout_session(
         )
 
 
+@traced
 async def delete_user_workout_session(id: int, user: User) -> None:
     """
     Delete an existing workout session for a user.
@@ -242,7 +323,12 @@ async def delete_user_workout_session(id: int, user: User) -> None:
     """
     try:
         workout_session_obj = await WorkoutSession.get(id=id, user=user)
+        exercise_log_ids = await ExerciseLog.filter(
+            workout_session_id=id, user=user
+        ).values_list("id", flat=True)
         await workout_session_obj.delete()
+        # its logs and their summaries went with it
+        await invalidate_summaries(user.pk, [workout_session_obj.date], exercise_log_ids)
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Workout session not found")
     except Exception as e:
@@ -251,6 +337,8 @@ async def delete_user_workout_session(id: int, user: User) -> None:
         )
 
 
+@traced
+@coalesce
 async def get_user_exercise_logs(id: int, user: User) -> list[ExerciseLogBase]:
     """
     Retrieve all exercise logs for a user.
@@ -262,9 +350,15 @@ async def get_user_exercise_logs(id: int, user: User) -> list[ExerciseLogBase]:
     :rtype: list[]
     """
     try:
-        exercise_logs = await ExerciseLog.filter(
-            workout_session__id=id, workout_session__user=user
-        )
+        exercise_logs = await ExerciseLog.filter(workout_session_id=id, user=user)
+        if not exercise_logs:
+            # the session may be archived
+            exercise_logs = [
+                archived_to_pydantic(ExerciseLog_Pydantic, exercise_log)
+                for exercise_log in await filter_archived_rows(
+                    user, "exercise_logs", workout_session_id=id
+                )
+            ]
         return exercise_logs
     except Exception as e:
         raise HTTPException(
@@ -272,6 +366,7 @@ async def get_user_exercise_logs(id: int, user: User) -> list[ExerciseLogBase]:
         )
 
 
+@traced
 async def get_user_exercise_log(id: int, user: User) -> ExerciseLogBase:
     """
     Retrieve a specific exercise log for a user by ID.
@@ -283,7 +378,12 @@ async def get_user_exercise_log(id: int, user: User) -> ExerciseLogBase:
     :rtype: ExerciseLog
     """
     try:
-        exercise_log_obj = await ExerciseLog.get(id=id, workout_session__user=user)
+        exercise_log_obj = await ExerciseLog.get_or_none(id=id, user=user)
+        if exercise_log_obj is None:
+            archived_log = await find_archived_row(user, "exercise_logs", id=id)
+            if archived_log is None:
+                raise DoesNotExist("Exercise Log not found")
+            return archived_to_pydantic(ExerciseLog_Pydantic, archived_log)
         return exercise_log_obj
     except DoesNotExist:
         raise HTTPException(status_code=404, detail=f"Exercise Log not found")
@@ -293,6 +393,7 @@ async def get_user_exercise_log(id: int, user: User) -> ExerciseLogBase:
         )
 
 
+@traced
 async def create_user_exercise_log(
     id: int, user: User, exercise_log: ExerciseLogCreate
 ) -> ExerciseLogBase:
@@ -307,16 +408,23 @@ async def create_user_exercise_log(
     :return: The created exercise log.
     :rtype: ExerciseLog
     """
+    if not await exercise_catalog.owns(user.pk, exercise_log.exercise_id, verify=True):
+        raise HTTPException(status_code=404, detail="Exercise not found")
     try:
+        # The workout session has to belong to the user, who is stored as the log's owner
+        workout_session_obj = await WorkoutSession.get(id=id, user=user)
         # Create the exercise log
         exercise_log_obj = await ExerciseLog.create(
-            workout_session_id=id,
+            workout_session=workout_session_obj,
+            user=user,
+            date=workout_session_obj.date,
             **exercise_log.model_dump(),
         )
         # Retrieve or create the exercise summary
         exercise_summary_obj, created = await ExerciseSummary.get_or_create(
             exercise_log=exercise_log_obj,
             defaults={
+                "user": user,
                 "total_sets": exercise_log.sets,
                 "total_reps": exercise_log.reps,
                 "total_holds": exercise_log.reps,
@@ -329,14 +437,18 @@ async def create_user_exercise_log(
             exercise_summary_obj.reps += exercise_log.reps
             await exercise_summary_obj.save()
 
+        await invalidate_summaries(user.pk, [exercise_log_obj.date])
         return exercise_log_obj
 
+    except DoesNotExist:
+        raise HTTPException(status_code=404, detail="Workout session not found")
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to create exercise log: {e}"
         )
 
 
+@traced
 async def update_user_exercise_log(
     id: int, user: User, exercise: ExerciseLogUpdate
 ) -> ExerciseLogBase:
@@ -353,12 +465,17 @@ async def update_user_exercise_log(
     :return: The updated exercise log.
     :rtype: ExerciseLog
     """
+    if exercise.exercise_id is not None and not await exercise_catalog.owns(
+        user.pk, exercise.exercise_id, verify=True
+    ):
+        raise HTTPException(status_code=404, detail="Exercise not found")
     try:
-        exercise_log_obj = await ExerciseLog.get(id=id, workout_session__user=user)
+        exercise_log_obj = await ExerciseLog.get(id=id, user=user)
         exercise_log = await exercise_log_obj.update_from_dict(
             exercise.model_dump(exclude_none=True)
         )
         await exercise_log.save()
+        await invalidate_summaries(user.pk, [exercise_log.date])
         return exercise_log
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Exercise log not found")
@@ -368,6 +485,7 @@ async def update_user_exercise_log(
         )
 
 
+@traced
 async def delete_user_exercise_log(id: int, user: User) -> None:
     """
     Delete an existing exercise log for a user.
@@ -380,8 +498,9 @@ async def delete_user_exercise_log(id: int, user: User) -> None:
     :return: None
     """
     try:
-        exercise_log_obj = await ExerciseLog.get(id=id, workout_session__user=user)
+        exercise_log_obj = await ExerciseLog.get(id=id, user=user)
         await exercise_log_obj.delete()
+        await invalidate_summaries(user.pk, [exercise_log_obj.date], [id])
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Exercise log not found")
     except Exception as e:
@@ -390,6 +509,8 @@ async def delete_user_exercise_log(id: int, user: User) -> None:
         )
 
 
+@traced
+@coalesce
 async def get_user_exercise_summary(id: int, user: User) -> ExerciseSummaryBase:
     """
     Retrieve a specific exercise summary for a user's exercise log.
@@ -403,10 +524,25 @@ async def get_user_exercise_summary(id: int, user: User) -> ExerciseSummaryBase:
     :rtype: ExerciseSummary
     """
     try:
-        exercise_summary_obj = await ExerciseSummary.get(
-            exercise_log_id=id, exercise_log__workout_session__user=user
-        )
-        return exercise_summary_obj
+        key = summary_log_key(user.pk, id)
+        generation = await get_summary_generation(user.pk)
+        cached = await get_cache().get(key)
+        if cached is not None:
+            return ExerciseSummary_Pydantic.model_validate(cached)
+        exercise_summary_obj = await ExerciseSummary.get_or_none(
+            exercise_log_id=id, user=user
+        )
+        if exercise_summary_obj is None:
+            archived_summary = await find_archived_row(
+                user, "exercise_summaries", exercise_log_id=id
+            )
+            if archived_summary is None:
+                raise DoesNotExist("Object does not exist")
+            exercise_summary = archived_to_pydantic(ExerciseSummary_Pydantic, archived_summary)
+        else:
+            exercise_summary = ExerciseSummary_Pydantic.model_validate(exercise_summary_obj)
+        await set_summary(key, user.pk, generation, exercise_summary.model_dump())
+        return exercise_summary
     except DoesNotExist as e:
         raise HTTPException(
             status_code=404, detail=f"Failed to retrieve exercise summary: {e}"
@@ -417,14 +553,17 @@ async def get_user_exercise_summary(id: int, user: User) -> ExerciseSummaryBase:
         )
 
 
+@traced
 async def create_user_exercise_summary(
-    id: int, summary: ExerciseSummaryCreate
+    id: int, user: User, summary: ExerciseSummaryCreate
 ) -> ExerciseSummaryCreate:
     """
     Create a new exercise summary for a user's exercise log.
 
     :param id: The ID of the exercise log.
     :type id: int
+    :param user: The user who owns the exercise log.
+    :type user: User
     :param summary: The exercise summary data to be created.
     :type summary: ExerciseSummaryCreate
     :raises HTTPException: If there is an error creating the exercise summary.
@@ -439,9 +578,11 @@ async def create_user_exercise_summary(
                 status_code=400,
                 detail="Exercise summary already exists for this exercise log.",
             )
+        exercise_log_obj = await ExerciseLog.get(id=id, user=user)
         exercise_summary_obj = await ExerciseSummary.create(
-            exercise_log_id=id, **summary.model_dump()
+            exercise_log=exercise_log_obj, user=user, **summary.model_dump()
         )
+        await invalidate_summaries(user.pk, exercise_log_ids=[id])
         return exercise_summary_obj
     
     except Exception as e:
@@ -450,6 +591,7 @@ async def create_user_exercise_summary(
         )
 
 
+@traced
 async def update_user_exercise_summary(
     id: int, user: User, summary: ExerciseSummaryUpdate
 ) -> ExerciseSummaryUpdate:
@@ -467,13 +609,14 @@ async def update_user_exercise_summary(
     :rtype: ExerciseSummary
     """
     try:
-        exercise_summary_obj = await ExerciseSummary.get(
-            id=id, exercise_log__workout_session__user=user
-        )
+        exercise_summary_obj = await ExerciseSummary.get(id=id, user=user)
         exercise_summary = await exercise_summary_obj.update_from_dict(
             summary.model_dump(exclude_none=True)
         )
         await exercise_summary.save()
+        await invalidate_summaries(
+            user.pk, exercise_log_ids=[exercise_summary.exercise_log_id]
+        )
         return exercise_summary
     except DoesNotExist:
         raise HTTPException(status_code=404, detail=f"Exercise summary not found")
@@ -483,6 +626,7 @@ async def update_user_exercise_summary(
         )
 
 
+@traced
 async def delete_user_exercise_summary(id: int, user: User) -> None:
     """
     Delete an existing exercise summary for a user's exercise log.
@@ -495,10 +639,11 @@ async def delete_user_exercise_summary(id: int, user: User) -> None:
     :return: None
     """
     try:
-        exercise_summary_obj = await ExerciseSummary.get(
-            id=id, exercise_log__workout_session__user=user
-        )
+        exercise_summary_obj = await ExerciseSummary.get(id=id, user=user)
         await exercise_summary_obj.delete()
+        await invalidate_summaries(
+            user.pk, exercise_log_ids=[exercise_summary_obj.exercise_log_id]
+        )
     except DoesNotExist:
         raise HTTPException(status_code=404, detail=f"Exercise summary not found")
     except Exception as e:
@@ -507,6 +652,8 @@ async def delete_user_exercise_summary(id: int, user: User) -> None:
         )
 
 
+@traced
+@coalesce
 async def get_user_exercises(user: User) -> list[ExerciseBase]:
     """
     Retrieve all exercises for a user.
@@ -518,14 +665,15 @@ async def get_user_exercises(user: User) -> list[ExerciseBase]:
     :rtype: list[ExerciseBase]
     """
     try:
-        exercises = Exercise.filter(user=user)
-        return await Exercise_Pydantic_List.from_queryset(exercises)
+        catalog = await exercise_catalog.get_catalog(user.pk)
+        return list(catalog.values())
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to retrieve exercises: {e}"
         )
 
 
+@traced
 async def get_user_exercise(id: int, user: User) -> ExerciseBase:
     """
     Retrieve a specific exercise for a user.
@@ -539,14 +687,17 @@ async def get_user_exercise(id: int, user: User) -> ExerciseBase:
     :rtype: ExerciseBase
     """
     try:
-        exercise_obj = await Exercise.get(id=id, user=user)
-        return exercise_obj
+        exercise = await exercise_catalog.get_exercise(user.pk, id)
+        if exercise is None:
+            raise DoesNotExist("Exercise not found")
+        return exercise
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Exercise not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve exercise: {e}")
 
 
+@traced
 async def create_user_exercise(user: User, exercise: ExerciseCreate) -> ExerciseBase:
     """
     Create a new exercise for a user.
@@ -561,11 +712,13 @@ async def create_user_exercise(user: User, exercise: ExerciseCreate) -> Exercise
     """
     try:
         exercise_obj = await Exercise.create(user=user, **exercise.model_dump())
+        exercise_catalog.put(user.pk, exercise_obj)
         return exercise_obj
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create exercise: {e}")
 
 
+@traced
 async def update_user_exercise(
     id: int, user: User, exercise: ExerciseUpdate
 ) -> ExerciseBase:
@@ -588,6 +741,7 @@ async def update_user_exercise(
             exercise.model_dump(exclude_none=True)
         )
         await exercise_.save()
+        exercise_catalog.put(user.pk, exercise_)
         return exercise_
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Exercise not found")
@@ -595,6 +749,7 @@ async def update_user_exercise(
         raise HTTPException(status_code=500, detail=f"Failed to update exercise: {e}")
 
 
+@traced
 async def delete_user_exercise(id: int, user: User) -> None:
     """
     Delete an existing exercise for a user.
@@ -608,54 +763,122 @@ async def delete_user_exercise(id: int, user: User) -> None:
     """
     try:
         exercise_obj = await Exercise.get(id=id, user=user)
+        exercise_logs = await ExerciseLog.filter(exercise_id=id, user=user).values_list(
+            "id", "date"
+        )
         await exercise_obj.delete()
+        exercise_catalog.remove(user.pk, id)
+        # its logs and their summaries went with it
+        await invalidate_summaries(
+            user.pk,
+            [date for _, date in exercise_logs],
+            [exercise_log_id for exercise_log_id, _ in exercise_logs],
+        )
     except DoesNotExist:
         raise HTTPException(status_code=404, detail="Exercise not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete exercise: {e}")
 
 
-async def get_weekly_exercise_summary(user: User, week_start: datetime) -> dict:
+@traced
+async def export_user_table(user: User, table: str, export_format: str) -> StreamingResponse:
     """
-    Get the exercise summary for a user for the entire week.
+    Stream all of a user's rows of a table, archived history included.
 
-    :param user: The user for whom the exercise summary is calculated.
+    :param user: The user whose data is exported.
     :type user: User
-    :param week_start: The start date of the week.
-    :type week_start: datetime
-    :return: A dictionary containing the total sets and reps for the week.
+    :param table: The table to export, one of EXPORT_TABLES.
+    :type table: str
+    :param export_format: The export format, one of EXPORT_MEDIA_TYPES.
+    :type export_format: str
+    :raises HTTPException: If the table or format is unknown.
+    :return: The streaming response.
+    :rtype: StreamingResponse
+    """
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="Export table not found")
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unknown export format")
+    extension = "ndjson" if export_format == "columnar" else export_format
+    return StreamingResponse(
+        stream_user_table(user, table, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{table}.{extension}"'
+        },
+    )
+
+
+def summarize_exercise_logs(exercise_logs: list[tuple[int, int]]) -> dict:
+    """
+    Aggregate the sets and reps of exercise logs.
+
+    :param exercise_logs: The sets and reps of each log.
+    :type exercise_logs: list[tuple[int, int]]
+    :return: A dictionary containing the total sets and reps.
     :rtype: dict
     """
-    try:
-        # Calculate the end date of the week
-        week_end = week_start + timedelta(days=7)
-        # Fetch all exercise logs for the user within the week
-        exercise_logs = await ExerciseLog.filter(
-            workout_session__user=user,
-            workout_session__date__gte=week_start,
-            workout_session__date__lt=week_end,
-        )
-
-        # Aggregate the sets and reps
-        total_sets = sum(log.sets for log in exercise_logs)
-        total_reps = sum(log.reps for log in exercise_logs)
-        total_holds = sum(log.reps for log in exercise_logs)
-
-        return {
-            "total_sets": total_sets,
-            "total_reps": total_reps,
-            "total_holds": total_holds,
-        }
+    return {
+        "total_sets": sum(sets for sets, _ in exercise_logs),
+        "total_reps": sum(reps for _, reps in exercise_logs),
+        "total_holds": sum(reps for _, reps in exercise_logs),
+    }
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to calculate weekly exercise summary: {e}"
+
+async def compute_monthly_summary(user: User, year: int, month: int) -> list:
+    """
+    Compute the exercise summary of each week in a month from the logs, archived ones included.
+
+    :param user: The user for whom the exercise summary is calculated.
+    :type user: User
+    :param year: The year of the month.
+    :type year: int
+    :param month: The month.
+    :type month: int
+    :return: The weekly summaries, JSON encoded.
+    :rtype: list
+    """
+    weeks = get_weeks_in_month(year, month)
+    # Fetch the logs of all the weeks at once, each week runs 7 days from its start,
+    # the last one into the next month
+    range_start = to_utc_datetime(weeks[0][0])
+    range_end = to_utc_datetime(weeks[-1][0] + timedelta(days=7))
+    exercise_logs = await ExerciseLog.filter(
+        user=user,
+        date__gte=range_start,
+        date__lt=range_end,
+    ).values_list("date", "sets", "reps")
+    exercise_logs += [
+        (exercise_log["date"], exercise_log["sets"], exercise_log["reps"])
+        for exercise_log in await get_archived_exercise_logs(user, range_start, range_end)
+    ]
+    weekly_summaries = []
+    for week_start, week_end in weeks:
+        start = to_utc_datetime(week_start)
+        end = start + timedelta(days=7)
+        weekly_summaries.append(
+            {
+                "week_start": week_start,
+                "week_end": week_end,
+                "summary": summarize_exercise_logs(
+                    [
+                        (sets, reps)
+                        for log_date, sets, reps in exercise_logs
+                        if start <= log_date < end
+                    ]
+                ),
+            }
         )
+    # cached as JSON so every backend stores it the same way
+    return jsonable_encoder(weekly_summaries)
 
 
+@traced
+@coalesce
 async def get_monthly_exercise_summary(user: User, year: int, month: int) -> list:
     """
     Get the exercise summary for a user for each week in a given month.
+    Summaries of closed months are stored in MonthlySummary and read back from there.
 
     :param user: The user for whom the exercise summary is calculated.
     :type user: User
@@ -667,19 +890,88 @@ async def get_monthly_exercise_summary(user: User, year: int, month: int) -> lis
     :rtype: list
     """
     try:
-        weeks = get_weeks_in_month(year, month)
-        weekly_summaries = [
-            {
-                "week_start": week_start,
-                "week_end": week_end,
-                "summary": await get_weekly_exercise_summary(user, week_start),
-            }
-            for week_start, week_end in weeks
-        ]
-
+        key = summary_month_key(user.pk, year, month)
+        generation = await get_summary_generation(user.pk)
+        cached = await get_cache().get(key)
+        if cached is not None:
+            return cached
+        closed = is_closed_month(year, month)
+        if closed:
+            stored = await MonthlySummary.get_or_none(user=user, month=date(year, month, 1))
+            if stored is not None:
+                await set_summary(key, user.pk, generation, stored.data)
+                return stored.data
+        weekly_summaries = await compute_monthly_summary(user, year, month)
+        if closed and await get_summary_generation(user.pk) == generation:
+            # only stored if none is, a backdated write's rebuild_monthly_summary
+            # job overwrites it, and may have already
+            await MonthlySummary.bulk_create(
+                [MonthlySummary(user=user, month=date(year, month, 1), data=weekly_summaries)],
+                ignore_conflicts=True,
+            )
+        await set_summary(key, user.pk, generation, weekly_summaries)
         return weekly_summaries
 
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to calculate monthly exercise summary: {e}"
         )
+
+
+@job(concurrency=2)
+async def rebuild_monthly_summary(user_id: str, year: int, month: int) -> None:
+    """
+    Recompute and store the summary of a closed month a backdated write dropped, before it's asked for again.
+
+    :param user_id: The ID of the user.
+    :type user_id: str
+    :param year: The year of the month.
+    :type year: int
+    :param month: The month.
+    :type month: int
+    :return: None
+    """
+    user = await User.get_or_none(object_id=user_id)
+    if user is None:
+        return
+    # computed from the logs, a stored or cached summary may predate the write
+    weekly_summaries = await compute_monthly_summary(user, year, month)
+    await MonthlySummary.update_or_create(
+        user=user, month=date(year, month, 1), defaults={"data": weekly_summaries}
+    )
+    await get_cache().delete(summary_month_key(user.pk, year, month))
+
+
+@traced
+async def get_exercise_progression(id: int, user: User) -> list[dict]:
+    """
+    Get the daily progression of one of a user's exercises, archived history included.
+
+    The computation runs in the process pool, so long histories don't hold up other requests.
+
+    :param id: The ID of the exercise.
+    :type id: int
+    :param user: The user whose exercise it is.
+    :type user: User
+    :raises HTTPException: If the exercise is not found, the process pool is saturated, or there is an error computing the progression.
+    :return: The volume, top intensity and rolling loads of each training day.
+    :rtype: list[dict]
+    """
+    if not await exercise_catalog.owns(user.pk, id):
+        raise HTTPException(status_code=404, detail="Exercise not found")
+    try:
+        exercise_logs = await ExerciseLog.filter(user=user, exercise_id=id).values_list(
+            "date", "sets", "reps", "intensity"
+        )
+        exercise_logs += [
+            (row["date"], row["sets"], row["reps"], row["intensity"])
+            for row in await filter_archived_rows(user, "exercise_logs", exercise_id=id)
+        ]
+        progression = await offload_pool.run(exercise_progression, pack_exercise_logs(exercise_logs))
+        return unpack_progression(progression)
+    except OffloadQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to compute exercise progression: {e}"
+        )
@@ -1,9 +1,27 @@
 import os
+from pathlib import Path
 from helpers import get_db_uri
 from dotenv import load_dotenv
+from settings import settings
+from tortoise import Tortoise
+from tortoise.exceptions import ConfigurationError, OperationalError
+from tortoise.utils import get_schema_sql
 
 load_dotenv(".env.database")
 
+MIGRATIONS_DIR = Path(__file__).parent / "migrations" / "models"
+
+# asyncpg pool options, passed through the connection URI
+DB_POOL_OPTIONS = {
+    "minsize": settings.DB_POOL_MIN_SIZE,
+    "maxsize": settings.DB_POOL_MAX_SIZE,
+    "max_queries": settings.DB_POOL_MAX_QUERIES,
+    "max_inactive_connection_lifetime": settings.DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+    "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    "timeout": settings.DB_CONNECT_TIMEOUT,
+    "command_timeout": settings.DB_COMMAND_TIMEOUT or None,
+}
+
 # Tortoise ORM configuration
 TORTOISE_ORM = {
     "connections": {
@@ -12,6 +30,8 @@ TORTOISE_ORM = {
             password=os.getenv("PASSWORD"),
             host=os.getenv("HOST"),
             db=os.getenv("DB"),
+            port=settings.DB_PORT,
+            **DB_POOL_OPTIONS,
         ),
     },
     "apps": { 
@@ -30,6 +50,8 @@ TORTOISE_ORM_TEST = {
             password=os.getenv("PASSWORD"),
             host=os.getenv("HOST"),
             db=os.getenv("TEST_DB"),
+            port=settings.DB_PORT,
+            **DB_POOL_OPTIONS,
         ),
     },
     "apps": { 
@@ -38,4 +60,111 @@ TORTOISE_ORM_TEST = {
             "default_connection": "default",
         },
     },
-}
\ No newline at end of file
+}
+
+# In-memory SQLite for quick test runs, `pytest --sqlite`, the tests of Postgres features are skipped
+TORTOISE_ORM_TEST_SQLITE = {
+    "connections": {"default": "sqlite://:memory:"},
+    "apps": TORTOISE_ORM_TEST["apps"],
+}
+
+# Read replica, only used when configured. Same credentials as the primary.
+# Reads are sent to it by db_router.ReplicaRouter
+if os.getenv("REPLICA_HOST"):
+    TORTOISE_ORM["connections"]["replica"] = get_db_uri(
+        user=os.getenv("USERNAME"),
+        password=os.getenv("PASSWORD"),
+        host=os.getenv("REPLICA_HOST"),
+        db=os.getenv("REPLICA_DB", os.getenv("DB")),
+        port=settings.DB_PORT,
+        **DB_POOL_OPTIONS,
+    )
+    TORTOISE_ORM["routers"] = ["db_router.ReplicaRouter"]
+
+# A second local database standing in for the replica in tests
+if os.getenv("TEST_REPLICA_DB"):
+    TORTOISE_ORM_TEST["connections"]["replica"] = get_db_uri(
+        user=os.getenv("USERNAME"),
+        password=os.getenv("PASSWORD"),
+        host=os.getenv("REPLICA_HOST", os.getenv("HOST")),
+        db=os.getenv("TEST_REPLICA_DB"),
+        port=settings.DB_PORT,
+        **DB_POOL_OPTIONS,
+    )
+    TORTOISE_ORM_TEST["routers"] = ["db_router.ReplicaRouter"]
+
+
+async def generate_replica_schemas() -> None:
+    """
+    Create the primary's tables on the replica connection.
+
+    Only meant for test databases standing in for a replica, a real replica
+    gets its schema through replication.
+
+    :return: None
+    """
+    schema = get_schema_sql(Tortoise.get_connection("default"), safe=True)
+    await Tortoise.get_connection("replica").execute_script(schema)
+
+
+def get_pool_stats(connection_name: str = "default") -> dict:
+    """
+    Get the saturation of the asyncpg pool behind a Tortoise connection.
+
+    :param connection_name: The name of the Tortoise connection.
+    :return: The pool size, idle and in-use connections, and the in-use ratio against the max size.
+    :rtype: dict
+    """
+    pool = getattr(Tortoise.get_connection(connection_name), "_pool", None)
+    if pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0, "min_size": 0, "max_size": 0, "saturation": 0.0}
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    max_size = pool.get_max_size()
+    return {
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min_size": pool.get_min_size(),
+        "max_size": max_size,
+        "saturation": (size - idle) / max_size if max_size else 0.0,
+    }
+
+
+def get_latest_migration() -> str | None:
+    """
+    Get the file name of the newest aerich migration shipped with the app.
+
+    :return: The file name, as aerich records it, or None if there are no migrations.
+    """
+    migrations = [path.name for path in MIGRATIONS_DIR.glob("*.py") if path.name[0].isdigit()]
+    if not migrations:
+        return None
+    return max(migrations, key=lambda name: int(name.split("_", 1)[0]))
+
+
+async def check_schema_version() -> str:
+    """
+    Check the database is migrated to the newest migration, with a single query.
+
+    Used at startup instead of generating the schemas, migrations are applied
+    beforehand with `aerich upgrade`.
+
+    :raises ConfigurationError: If no migrations are shipped, or the database is not migrated or behind the app.
+    :return: The applied migration.
+    """
+    expected = get_latest_migration()
+    if expected is None:
+        raise ConfigurationError(f"No migrations found in {MIGRATIONS_DIR}, they must ship with the app")
+    try:
+        _, rows = await Tortoise.get_connection("default").execute_query(
+            'SELECT "version" FROM "aerich" WHERE "app" = $1 ORDER BY "id" DESC LIMIT 1', ["models"]
+        )
+    except OperationalError:
+        rows = []
+    applied = rows[0]["version"] if rows else None
+    if applied != expected:
+        raise ConfigurationError(
+            f"Database schema is at {applied}, expected {expected}, run `aerich upgrade`"
+        )
+    return applied
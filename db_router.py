@@ -0,0 +1,77 @@
+from contextvars import ContextVar
+from tortoise import connections
+from cache import get_cache
+from settings import settings
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Whether queries of the current request must go to the primary, True outside requests
+_use_primary: ContextVar[bool] = ContextVar("use_primary", default=True)
+
+
+class ReplicaRouter:
+    """
+    Tortoise ORM router sending reads to the `replica` connection and writes to `default`.
+
+    Reads stay on the primary for requests flagged by `route_request`.
+    """
+
+    def db_for_read(self, model):
+        return "default" if _use_primary.get() else "replica"
+
+    def db_for_write(self, model):
+        return "default"
+
+
+def recent_write_key(user_id: str) -> str:
+    return f"writes:{user_id}"
+
+
+async def route_request(user_id: str, method: str) -> None:
+    """
+    Pick the connection reads of the current request go to.
+
+    Writes are recorded per user, and the user's reads stay on the primary
+    for `DB_READ_YOUR_WRITES_WINDOW` seconds after so they see their own writes
+    despite replication lag. The writes are recorded in the cache backend, so
+    every worker sharing it sees them.
+
+    :param user_id: The ID of the authenticated user.
+    :param method: The HTTP method of the request.
+    :return: None
+    """
+    if "replica" not in connections.db_config:
+        _use_primary.set(True)
+        return
+    if method not in READ_METHODS:
+        _use_primary.set(True)
+        await get_cache().set(recent_write_key(user_id), 1, ttl=settings.DB_READ_YOUR_WRITES_WINDOW)
+    else:
+        _use_primary.set(await get_cache().peek(recent_write_key(user_id)) is not None)
+
+
+def reads_from_primary() -> bool:
+    return _use_primary.get()
+
+
+def read_connection_name() -> str:
+    """
+    Get the connection reads of the current request go to, as ReplicaRouter picks it.
+
+    For raw queries, which the router doesn't see.
+
+    :return: `replica` or `default`.
+    """
+    if "replica" in connections.db_config and not reads_from_primary():
+        return "replica"
+    return "default"
+
+
+async def forget_writes(user_id: str) -> None:
+    """
+    Drop the recorded writes of a user, sending their next reads to the replica.
+
+    :param user_id: The ID of the user.
+    :return: None
+    """
+    await get_cache().delete(recent_write_key(user_id))
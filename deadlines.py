@@ -0,0 +1,118 @@
+import asyncio
+from starlette.routing import Match
+from settings import settings
+
+DEADLINE_BODY = b'{"detail":"Request deadline exceeded"}'
+READ_AHEAD = 4  # request body chunks buffered before the app reads them
+
+# requests cancelled before completing, by reason
+cancellations = {"deadline": 0, "disconnect": 0}
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware cancelling a request when its deadline passes or its client disconnects.
+
+    The deadline is REQUEST_DEADLINE, or the REQUEST_DEADLINES entry of the
+    route template, 0 for none. It runs until the response starts, so streamed
+    responses aren't cut off, and a request over it gets a 504. The cancellation
+    reaches the query awaited at the time, which asyncpg cancels on the server.
+    A disconnect cancels the request at any point.
+    """
+
+    def __init__(self, app, routes: list):
+        self.app = app
+        self.routes = routes  # of the app, matched for the per route deadlines
+
+    def get_deadline(self, scope) -> float:
+        """
+        Get the deadline of a request.
+
+        :param scope: The ASGI scope of the request.
+        :return: Seconds, 0 for none.
+        """
+        if settings.REQUEST_DEADLINES:
+            for route in self.routes:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    return settings.REQUEST_DEADLINES.get(route.path, settings.REQUEST_DEADLINE)
+        return settings.REQUEST_DEADLINE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        deadline = self.get_deadline(scope)
+        # the request messages, read ahead so a disconnect is noticed while the app works
+        messages = asyncio.Queue(maxsize=READ_AHEAD)
+        disconnected = asyncio.Event()
+        response_started = response_complete = False
+
+        async def app_receive():
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def app_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        async def watch_disconnect():
+            # from the start, routes without a body never call receive
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    if not messages.full():
+                        messages.put_nowait(message)  # wakes an app waiting for a message
+                    return
+                await messages.put(message)
+
+        app_task = asyncio.create_task(self.app(scope, app_receive, app_send))
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            timeout = deadline or None
+            while True:
+                done, _ = await asyncio.wait(
+                    (app_task, watcher), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if app_task in done:
+                    return app_task.result()
+                if watcher in done:
+                    if response_complete:
+                        # servers report a finished response as a disconnect too
+                        return await app_task
+                    cancellations["disconnect"] += 1
+                    await self.cancel(app_task)
+                    return
+                if response_started:
+                    timeout = None
+                    continue
+                cancellations["deadline"] += 1
+                await self.cancel(app_task)
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": 504,
+                        "headers": [
+                            (b"content-type", b"application/json"),
+                            (b"content-length", str(len(DEADLINE_BODY)).encode()),
+                        ],
+                    }
+                )
+                await send({"type": "http.response.body", "body": DEADLINE_BODY})
+                return
+        finally:
+            watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
+
+    @staticmethod
+    async def cancel(task: asyncio.Task) -> None:
+        task.cancel()
+        await asyncio.wait((task,))
+        if not task.cancelled():
+            task.exception()  # it failed while cancelled, nobody is left to report it to
@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import AsyncIterator
+from tortoise import connections
+from archive import iter_archived_rows
+from db_router import read_connection_name
+from models import User
+from settings import settings
+
+# Exportable tables: route name -> (table, columns, key in the archive if it gets archived)
+EXPORT_TABLES = {
+    "workout-plans": ("workoutplan", ("id", "name", "description"), None),
+    "workout-sessions": ("workoutsession", ("id", "date", "comments"), "sessions"),
+    "exercise-logs": (
+        "exerciselog",
+        ("id", "workout_session_id", "exercise_id", "date", "sets", "reps", "intensity", "exertion_scale"),
+        "exercise_logs",
+    ),
+    "exercises": ("exercise", ("id", "name", "description", "category", "muscle_group"), None),
+}
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    # one JSON object of column lists per chunk, one chunk per line
+    "columnar": "application/x-ndjson",
+}
+
+
+def to_export_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def encode_chunk(rows: list[tuple], columns: tuple[str, ...], export_format: str, header: bool) -> bytes:
+    """
+    Encode a chunk of rows in the export format.
+
+    :param rows: The rows, values ordered as the columns.
+    :param columns: The column names.
+    :param export_format: `csv`, `ndjson` or `columnar`.
+    :param header: Whether this is the first chunk, the CSV header is written before it.
+    :return: The encoded chunk.
+    """
+    rows = [[to_export_value(value) for value in row] for row in rows]
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(columns)
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+    if export_format == "columnar":
+        if not rows:
+            return b""
+        chunk = {column: list(values) for column, values in zip(columns, zip(*rows))}
+        return (json.dumps({"columns": chunk}, separators=(",", ":")) + "\n").encode()
+    return "".join(
+        json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n" for row in rows
+    ).encode()
+
+
+async def stream_user_table(
+    user: User, table_name: str, export_format: str, chunk_size: int = None
+) -> AsyncIterator[bytes]:
+    """
+    Stream every row a user has in a table, archived rows first.
+
+    Rows are read through a server-side cursor, `chunk_size` at a time, so memory
+    stays bounded whatever the size of the history. The cursor holds a pooled
+    connection until the stream ends.
+
+    :param user: The user whose rows are exported.
+    :param table_name: A key of EXPORT_TABLES.
+    :param export_format: `csv`, `ndjson` or `columnar`.
+    :param chunk_size: Rows per fetch and per encoded chunk, defaults to EXPORT_CHUNK_SIZE.
+    :return: The encoded chunks.
+    """
+    if chunk_size is None:
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+    table, columns, archive_key = EXPORT_TABLES[table_name]
+    header = True
+    if archive_key is not None:
+        async for archived in iter_archived_rows(user, archive_key):
+            for start in range(0, len(archived), chunk_size):
+                rows = [
+                    tuple(row[column] for column in columns)
+                    for row in archived[start : start + chunk_size]
+                ]
+                yield encode_chunk(rows, columns, export_format, header)
+                header = False
+
+    query = 'SELECT {} FROM "{}" WHERE "user_id" = $1 ORDER BY "id"'.format(
+        ", ".join(f'"{column}"' for column in columns), table
+    )
+    # reads follow the replica routing of the request
+    client = connections.get(read_connection_name())
+    async with client.acquire_connection() as connection:
+        async with connection.transaction(readonly=True):
+            rows = []
+            async for record in connection.cursor(query, user.pk, prefetch=chunk_size):
+                rows.append(tuple(record.values()))
+                if len(rows) == chunk_size:
+                    yield encode_chunk(rows, columns, export_format, header)
+                    header = False
+                    rows = []
+            if rows or header:
+                yield encode_chunk(rows, columns, export_format, header)
@@ -1,9 +1,24 @@
 import calendar
-from datetime import timedelta, date
+from datetime import datetime, timedelta, timezone, date
+from urllib.parse import quote_plus, urlencode
 
 
-def get_db_uri(user, password, host, db):
-    return f"postgres://{user}:{password}@{host}:5432/{db}"
+def get_db_uri(user, password, host, db, port=5432, **options):
+    """
+    Build a Tortoise ORM postgres URI.
+
+    :param user: The database user.
+    :param password: The database password.
+    :param host: The database host.
+    :param db: The database name.
+    :param port: The database port.
+    :param options: Extra connection/pool options appended as query parameters,
+        options set to None are left out.
+    :return: The database URI.
+    """
+    uri = f"postgres://{user}:{quote_plus(str(password))}@{host}:{port}/{db}"
+    query = urlencode({key: value for key, value in options.items() if value is not None})
+    return f"{uri}?{query}" if query else uri
 
 
 def get_weeks_in_month(year: int, month: int):
@@ -35,5 +50,21 @@ def get_weeks_in_month(year: int, month: int):
     return weeks
 
 
+def is_closed_month(year: int, month: int, today: date = None) -> bool:
+    """
+    Check whether no log dated from today on counts in a month's summary any more.
+
+    The last week of a month's summary runs 7 days from its start, into the next month.
+
+    :param year: The year of the month.
+    :param month: The month.
+    :param today: The current date, defaults to today in UTC.
+    :return: True if the month is closed.
+    """
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+    last_week_start = get_weeks_in_month(year, month)[-1][0]
+    return last_week_start + timedelta(days=7) <= today
+
 if __name__ == "__main__":
     pass
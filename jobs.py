@@ -0,0 +1,317 @@
+"""
+Durable background jobs, stored in the job table and claimed with FOR UPDATE SKIP LOCKED.
+
+Handlers are registered with `@job`, and requests hand them work with `enqueue`,
+a single insert, so their latency doesn't include it. Each API worker runs a
+JobWorker from the app's lifespan, or they run in a process of their own:
+
+    python jobs.py
+    python jobs.py --once  # the due jobs, then exit
+
+A done job is deleted. A failed attempt is retried after JOB_RETRY_BACKOFF,
+doubled after each, and after the last one the job is kept as `failed`.
+Handlers may run more than once, e.g. after a worker died mid-job, so they
+must be idempotent.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+from tortoise import Tortoise, run_async
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F, Q
+from tortoise.transactions import in_transaction
+from database import TORTOISE_ORM
+from models import Job
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, FAILED = "pending", "running", "failed"
+
+
+@dataclass
+class JobHandler:
+    func: Callable[..., Awaitable[Any]]
+    concurrency: int  # jobs of this handler a worker runs at once, 0 for no limit of its own
+    max_attempts: int | None
+
+
+JOBS: dict[str, JobHandler] = {}
+
+
+def job(name: str = None, concurrency: int = 0, max_attempts: int = None):
+    """
+    Register a coroutine function as a job handler, it gets the job's payload as keyword arguments.
+
+    :param name: The name jobs are enqueued with, defaults to the function's.
+    :param concurrency: Jobs of the handler a worker runs at once, 0 for no limit of its own.
+    :param max_attempts: Attempts before a job is given up, defaults to JOB_MAX_ATTEMPTS.
+    :return: The decorator, it returns the function unchanged.
+    """
+
+    def decorator(func):
+        JOBS[name or func.__name__] = JobHandler(func, concurrency, max_attempts)
+        return func
+
+    return decorator
+
+
+async def enqueue(
+    name: str, payload: dict = None, key: str = None, delay: float = 0.0, max_attempts: int = None
+) -> Job | None:
+    """
+    Hand work to the job workers.
+
+    A job isn't enqueued while one with the same key waits to start, so work asked
+    for by many writes runs once. The key is released when the job starts, a job
+    enqueued after that runs again, the running one may have read before the write.
+
+    :param name: The name of the handler.
+    :param payload: The handler's keyword arguments, JSON serializable.
+    :param key: The idempotency key, None for none.
+    :param delay: Seconds before the job may start.
+    :param max_attempts: Defaults to the handler's, or JOB_MAX_ATTEMPTS.
+    :return: The job, None if one with the key is already waiting.
+    """
+    if max_attempts is None:
+        handler = JOBS.get(name)
+        max_attempts = handler and handler.max_attempts or settings.JOB_MAX_ATTEMPTS
+    if key is not None and await Job.exists(key=key):
+        return None
+    try:
+        job_obj = await Job.create(
+            name=name,
+            payload=payload or {},
+            key=key,
+            max_attempts=max_attempts,
+            run_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+        )
+    except IntegrityError:  # enqueued by another request meanwhile
+        return None
+    if not delay:
+        job_worker.notify()
+    return job_obj
+
+
+async def claim_jobs(names: list[str], limit: int) -> list[Job]:
+    """
+    Claim due jobs, skipping those other workers are claiming.
+
+    Jobs left running for twice JOB_TIMEOUT are claimed again, their worker died.
+
+    :param names: The handlers the jobs may be of.
+    :param limit: The most jobs claimed.
+    :return: The claimed jobs, marked running.
+    """
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=2 * settings.JOB_TIMEOUT)
+    async with in_transaction("default") as connection:
+        jobs = await Job.filter(
+            Q(status=PENDING, run_at__lte=now) | Q(status=RUNNING, locked_at__lt=stale),
+            name__in=names,
+        ).order_by("run_at").limit(limit).select_for_update(skip_locked=True).using_db(connection)
+        if jobs:
+            await Job.filter(id__in=[job_obj.id for job_obj in jobs]).using_db(connection).update(
+                status=RUNNING, locked_at=now, key=None, attempts=F("attempts") + 1
+            )
+    for job_obj in jobs:
+        job_obj.status, job_obj.locked_at, job_obj.key = RUNNING, now, None
+        job_obj.attempts += 1
+    return jobs
+
+
+class JobWorker:
+    """
+    Runs the due jobs of the registered handlers, up to `concurrency` at once.
+
+    Polls every JOB_POLL_INTERVAL seconds, and right away when a job is enqueued
+    through the same process or one of its jobs finishes.
+    """
+
+    def __init__(self, concurrency: int = None):
+        self.concurrency = settings.JOB_CONCURRENCY if concurrency is None else concurrency
+        self._running: dict[asyncio.Task, Job] = {}
+        self._task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._task is None and self.concurrency > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop claiming jobs, and give the running ones JOB_SHUTDOWN_TIMEOUT seconds to finish.
+
+        Jobs still running are cancelled and put back, without counting the attempt.
+
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait((self._task,))
+            self._task = None
+        if self._running:
+            await asyncio.wait(self._running, timeout=settings.JOB_SHUTDOWN_TIMEOUT)
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def _free_slots(self) -> list[tuple[list[str], int]]:
+        # the handlers jobs may be claimed for, and how many, in groups
+        free = self.concurrency - len(self._running)
+        running = Counter(job_obj.name for job_obj in self._running.values())
+        unlimited = [name for name, handler in JOBS.items() if not handler.concurrency]
+        slots = [(unlimited, free)] if unlimited else []
+        for name, handler in JOBS.items():
+            if handler.concurrency:
+                slots.append(([name], min(free, handler.concurrency - running[name])))
+        return slots
+
+    async def claim(self) -> int:
+        """
+        Claim due jobs for the free slots and start them.
+
+        :return: The number of jobs started.
+        """
+        started = 0
+        for names, slots in self._free_slots():
+            slots = min(slots, self.concurrency - len(self._running))
+            if slots <= 0:
+                continue
+            for job_obj in await claim_jobs(names, slots):
+                task = asyncio.create_task(self.execute(job_obj))
+                self._running[task] = job_obj
+                task.add_done_callback(self._finished)
+                started += 1
+        return started
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._running.pop(task, None)
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                started = await self.claim()
+            except Exception:
+                logger.exception("Failed to claim jobs")
+                started = 0
+            if started and len(self._running) < self.concurrency:
+                continue  # there may be more due
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pending(self) -> int:
+        """
+        Run the due jobs until none is left, retries that aren't due yet excluded.
+
+        :return: The number of jobs run.
+        """
+        run = 0
+        while True:
+            run += await self.claim()
+            if not self._running:
+                return run
+            await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+
+    async def execute(self, job_obj: Job) -> None:
+        """
+        Run a claimed job, and delete it, retry it later or mark it failed.
+
+        If the job table can't be updated the job stays running, and is claimed again once stale.
+
+        :param job_obj: The job.
+        :return: None
+        """
+        handler = JOBS.get(job_obj.name)
+        error = None
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for {job_obj.name} jobs")
+            await asyncio.wait_for(handler.func(**job_obj.payload), settings.JOB_TIMEOUT)
+        except asyncio.CancelledError:
+            await Job.filter(id=job_obj.id).update(
+                status=PENDING, locked_at=None, attempts=F("attempts") - 1
+            )
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        try:
+            if error is None:
+                await Job.filter(id=job_obj.id).delete()
+                self.completed += 1
+            elif job_obj.attempts < job_obj.max_attempts:
+                logger.warning(
+                    "Job %s #%s failed, attempt %d of %d: %s",
+                    job_obj.name, job_obj.id, job_obj.attempts, job_obj.max_attempts, error,
+                )
+                delay = settings.JOB_RETRY_BACKOFF * 2 ** (job_obj.attempts - 1)
+                await Job.filter(id=job_obj.id).update(
+                    status=PENDING,
+                    locked_at=None,
+                    run_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+                    error=error,
+                )
+                self.retried += 1
+            else:
+                logger.error("Job %s #%s failed for good: %s", job_obj.name, job_obj.id, error)
+                await Job.filter(id=job_obj.id).update(status=FAILED, error=error)
+                self.failed += 1
+        except Exception:
+            logger.exception("Failed to record the outcome of job %s #%s", job_obj.name, job_obj.id)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._running),
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+job_worker = JobWorker()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the background jobs outside the API workers")
+    parser.add_argument("--concurrency", type=int, default=settings.JOB_CONCURRENCY or 4)
+    parser.add_argument("--once", action="store_true", help="run the due jobs, then exit")
+    args = parser.parse_args()
+
+    async def run():
+        import controllers, partitioning  # register the handlers
+
+        logging.basicConfig(level=logging.INFO)
+        await Tortoise.init(config=TORTOISE_ORM)
+        worker = JobWorker(args.concurrency)
+        if args.once:
+            print(f"Ran {await worker.run_pending()} jobs")
+            return
+        stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
+        worker.start()
+        await stopping.wait()
+        await worker.stop()
+
+    run_async(run())
+
+
+if __name__ == "__main__":
+    main()
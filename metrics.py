@@ -0,0 +1,209 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from tortoise.exceptions import ConfigurationError
+from cache import exercise_catalog, get_cache
+from coalesce import single_flight
+from database import get_pool_stats
+from deadlines import cancellations
+from jobs import job_worker
+from offload import offload_pool
+from ratelimit import pool_waits, rate_limited
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"  # 404s, so random paths don't each get their own series
+
+
+class RequestMetrics:
+    """
+    Request counts, latencies and in-flight requests per route, in memory of the process.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.requests: dict[tuple[str, str, int], int] = defaultdict(int)
+        # (method, route) -> [count per bucket, +Inf included], sum
+        self.latencies: dict[tuple[str, str], list] = {}
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        self.requests[method, route, status] += 1
+        histogram = self.latencies.get((method, route))
+        if histogram is None:
+            histogram = self.latencies[method, route] = [[0] * (len(self.buckets) + 1), 0.0]
+        histogram[0][bisect_left(self.buckets, seconds)] += 1
+        histogram[1] += seconds
+
+    def reset(self) -> None:
+        self.requests.clear()
+        self.latencies.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording every HTTP request in `request_metrics`, labelled by route template.
+    """
+
+    def __init__(self, app, metrics: RequestMetrics = None):
+        self.app = app
+        self.metrics = metrics or request_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            route = scope.get("route")
+            metrics.observe(
+                scope["method"],
+                route.path if route is not None else UNMATCHED_ROUTE,
+                status,
+                time.perf_counter() - started,
+            )
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_metrics(metrics: RequestMetrics = None) -> str:
+    """
+    Render the metrics in the Prometheus text exposition format.
+
+    Besides the requests, reports the database pools and the caches at the time of the scrape.
+
+    :param metrics: The request metrics, defaults to those of the middleware.
+    :return: The exposition text.
+    """
+    metrics = metrics or request_metrics
+    lines = [
+        "# HELP http_requests_total Requests handled, by route template and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), count in sorted(metrics.requests.items()):
+        lines.append(
+            f"http_requests_total{format_labels(method=method, route=route, status=status)} {count}"
+        )
+    lines += [
+        "# HELP http_request_duration_seconds Request latency, by route template.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), (counts, total) in sorted(metrics.latencies.items()):
+        cumulative = 0
+        for bound, count in zip((*metrics.buckets, "+Inf"), counts):
+            cumulative += count
+            labels = format_labels(method=method, route=route, le=bound)
+            lines.append(f"http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = format_labels(method=method, route=route)
+        lines.append(f"http_request_duration_seconds_sum{labels} {total}")
+        lines.append(f"http_request_duration_seconds_count{labels} {cumulative}")
+    lines += [
+        "# HELP http_requests_in_flight Requests being handled.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {metrics.in_flight}",
+    ]
+
+    pools = []
+    for connection in ("default", "replica"):
+        try:
+            pools.append((connection, get_pool_stats(connection)))
+        except ConfigurationError:
+            pass
+    for name, key, help_text in (
+        ("db_pool_size", "size", "Connections open in the pool."),
+        ("db_pool_in_use", "in_use", "Connections checked out of the pool."),
+        ("db_pool_max_size", "max_size", "Maximum connections of the pool."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{format_labels(connection=connection)} {stats[key]}" for connection, stats in pools]
+
+    caches = {"summary": get_cache().stats(), "exercise_catalog": exercise_catalog.stats()}
+    for name, key, help_text in (
+        ("cache_hits_total", "hits", "Cache lookups served from the cache."),
+        ("cache_misses_total", "misses", "Cache lookups that missed."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f"{name}{format_labels(cache=cache)} {stats[key]}" for cache, stats in caches.items()]
+    coalescing = single_flight.stats()
+    lines += [
+        "# HELP coalesced_calls_total Coalesced controller calls, and those served by another call's computation.",
+        "# TYPE coalesced_calls_total counter",
+        f'coalesced_calls_total{format_labels(shared="false")} {coalescing["calls"] - coalescing["shared"]}',
+        f'coalesced_calls_total{format_labels(shared="true")} {coalescing["shared"]}',
+    ]
+    lines += [
+        "# HELP rate_limited_requests_total Requests refused by the per user rate limits, by route class.",
+        "# TYPE rate_limited_requests_total counter",
+    ]
+    lines += [
+        f"rate_limited_requests_total{format_labels(route_class=route_class)} {count}"
+        for route_class, count in rate_limited.items()
+    ]
+    lines += [
+        "# HELP shed_requests_total Requests refused while the database pools were saturated.",
+        "# TYPE shed_requests_total counter",
+        f"shed_requests_total {pool_waits.shed}",
+        "# HELP db_pool_wait_seconds Recent wait for a database connection, as load shedding sees it.",
+        "# TYPE db_pool_wait_seconds gauge",
+        f"db_pool_wait_seconds {pool_waits.wait_time()}",
+    ]
+    lines += [
+        "# HELP request_cancellations_total Requests cancelled before completing, by reason.",
+        "# TYPE request_cancellations_total counter",
+    ]
+    lines += [
+        f"request_cancellations_total{format_labels(reason=reason)} {count}"
+        for reason, count in cancellations.items()
+    ]
+    offload = offload_pool.stats()
+    lines += [
+        "# HELP offload_workers Processes of the analytics process pool.",
+        "# TYPE offload_workers gauge",
+        f"offload_workers {offload['workers']}",
+        "# HELP offload_in_flight Tasks submitted to the process pool and not finished.",
+        "# TYPE offload_in_flight gauge",
+        f"offload_in_flight {offload['in_flight']}",
+        "# HELP offload_queue_depth Tasks waiting for a free process.",
+        "# TYPE offload_queue_depth gauge",
+        f"offload_queue_depth {offload['queue_depth']}",
+        "# HELP offload_tasks_total Tasks of the process pool, by outcome.",
+        "# TYPE offload_tasks_total counter",
+    ]
+    lines += [
+        f"offload_tasks_total{format_labels(outcome=outcome)} {offload[outcome]}"
+        for outcome in ("completed", "failed", "rejected")
+    ]
+    jobs = job_worker.stats()
+    lines += [
+        "# HELP jobs_running Background jobs this process is running.",
+        "# TYPE jobs_running gauge",
+        f"jobs_running {jobs['running']}",
+        "# HELP job_attempts_total Background job attempts of this process, by outcome.",
+        "# TYPE job_attempts_total counter",
+    ]
+    lines += [
+        f"job_attempts_total{format_labels(outcome=outcome)} {jobs[outcome]}"
+        for outcome in ("completed", "retried", "failed")
+    ]
+    return "\n".join(lines) + "\n"
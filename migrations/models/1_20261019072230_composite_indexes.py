@@ -0,0 +1,23 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX "idx_calendarent_workout_50eb16" ON "calendarentry" ("workout_session_id");
+        CREATE INDEX "idx_exercise_user_id_ba21ec" ON "exercise" ("user_id");
+        CREATE INDEX "idx_exerciselog_session_cover" ON "exerciselog" USING BTREE ("workout_session_id") INCLUDE ("sets", "reps");
+        CREATE INDEX "idx_exerciselog_exercis_7ba625" ON "exerciselog" ("exercise_id");
+        CREATE INDEX "idx_exercisesum_exercis_6d785b" ON "exercisesummary" ("exercise_log_id");
+        CREATE INDEX "idx_workoutplan_user_id_1710b7" ON "workoutplan" ("user_id");
+        CREATE INDEX "idx_workoutsess_user_id_e19869" ON "workoutsession" ("user_id", "date");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_exercisesum_exercis_6d785b";
+        DROP INDEX "idx_workoutsess_user_id_e19869";
+        DROP INDEX "idx_calendarent_workout_50eb16";
+        DROP INDEX "idx_workoutplan_user_id_1710b7";
+        DROP INDEX "idx_exerciselog_exercis_7ba625";
+        DROP INDEX "idx_exerciselog_session_cover";
+        DROP INDEX "idx_exercise_user_id_ba21ec";"""
@@ -0,0 +1,25 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "exerciselog" ADD "user_id" VARCHAR(100);
+        ALTER TABLE "exercisesummary" ADD "user_id" VARCHAR(100);
+        UPDATE "exerciselog" SET "user_id" = "workoutsession"."user_id" FROM "workoutsession" WHERE "exerciselog"."workout_session_id" = "workoutsession"."id";
+        UPDATE "exercisesummary" SET "user_id" = "exerciselog"."user_id" FROM "exerciselog" WHERE "exercisesummary"."exercise_log_id" = "exerciselog"."id";
+        ALTER TABLE "exerciselog" ALTER COLUMN "user_id" SET NOT NULL;
+        ALTER TABLE "exercisesummary" ALTER COLUMN "user_id" SET NOT NULL;
+        CREATE INDEX "idx_exerciselog_user_id_8ff544" ON "exerciselog" ("user_id");
+        ALTER TABLE "exerciselog" ADD CONSTRAINT "fk_exercise_user_06bf484e" FOREIGN KEY ("user_id") REFERENCES "user" ("object_id") ON DELETE CASCADE;
+        CREATE INDEX "idx_exercisesum_user_id_e756b3" ON "exercisesummary" ("user_id");
+        ALTER TABLE "exercisesummary" ADD CONSTRAINT "fk_exercise_user_57af2e1f" FOREIGN KEY ("user_id") REFERENCES "user" ("object_id") ON DELETE CASCADE;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "exercisesummary" DROP CONSTRAINT "fk_exercise_user_57af2e1f";
+        DROP INDEX "idx_exercisesum_user_id_e756b3";
+        ALTER TABLE "exerciselog" DROP CONSTRAINT "fk_exercise_user_06bf484e";
+        DROP INDEX "idx_exerciselog_user_id_8ff544";
+        ALTER TABLE "exerciselog" DROP COLUMN "user_id";
+        ALTER TABLE "exercisesummary" DROP COLUMN "user_id";"""
@@ -0,0 +1,21 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "exerciselog" ADD "date" TIMESTAMPTZ;
+        UPDATE "exerciselog" SET "date" = "workoutsession"."date" FROM "workoutsession" WHERE "exerciselog"."workout_session_id" = "workoutsession"."id";
+        ALTER TABLE "exerciselog" ALTER COLUMN "date" SET NOT NULL;
+        DROP INDEX "idx_exerciselog_user_id_8ff544";
+        DROP INDEX "idx_exerciselog_session_cover";
+        CREATE INDEX "idx_exerciselog_user_date_cover" ON "exerciselog" USING BTREE ("user_id", "date") INCLUDE ("sets", "reps");
+        CREATE INDEX "idx_exerciselog_workout_e5f957" ON "exerciselog" ("workout_session_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_exerciselog_workout_e5f957";
+        DROP INDEX "idx_exerciselog_user_date_cover";
+        ALTER TABLE "exerciselog" DROP COLUMN "date";
+        CREATE INDEX "idx_exerciselog_session_cover" ON "exerciselog" USING BTREE ("workout_session_id") INCLUDE ("sets", "reps");
+        CREATE INDEX "idx_exerciselog_user_id_8ff544" ON "exerciselog" ("user_id");"""
@@ -0,0 +1,18 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "workoutarchive" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "month" DATE NOT NULL,
+    "data" BYTEA NOT NULL,
+    "user_id" VARCHAR(100) NOT NULL REFERENCES "user" ("object_id") ON DELETE CASCADE,
+    CONSTRAINT "uid_workoutarch_user_id_fe471c" UNIQUE ("user_id", "month")
+);
+COMMENT ON TABLE "workoutarchive" IS 'A month of a user''s archived workout history, see archive.py.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "workoutarchive";"""
@@ -0,0 +1,18 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "monthlysummary" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "month" DATE NOT NULL,
+    "data" JSONB NOT NULL,
+    "user_id" VARCHAR(100) NOT NULL REFERENCES "user" ("object_id") ON DELETE CASCADE,
+    CONSTRAINT "uid_monthlysumm_user_id_4498cb" UNIQUE ("user_id", "month")
+);
+COMMENT ON TABLE "monthlysummary" IS 'The weekly summaries of a closed month, computed once, see get_monthly_exercise_summary.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "monthlysummary";"""
@@ -0,0 +1,25 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "job" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "name" VARCHAR(100) NOT NULL,
+    "payload" JSONB NOT NULL,
+    "key" VARCHAR(255)  UNIQUE,
+    "status" VARCHAR(16) NOT NULL  DEFAULT 'pending',
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "max_attempts" INT NOT NULL  DEFAULT 1,
+    "run_at" TIMESTAMPTZ NOT NULL,
+    "locked_at" TIMESTAMPTZ,
+    "error" TEXT,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS "idx_job_status_920a13" ON "job" ("status", "run_at");
+COMMENT ON TABLE "job" IS 'Deferred work, claimed and run by the job workers of jobs.py.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "job";"""
@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "workoutarchive" ADD "lookup" JSONB;
+        ALTER TABLE "workoutarchive" ADD "sessions" JSONB;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "workoutarchive" DROP COLUMN "lookup";
+        ALTER TABLE "workoutarchive" DROP COLUMN "sessions";"""
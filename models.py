@@ -1,7 +1,36 @@
 from tortoise import fields, models
+from tortoise.contrib.postgres.indexes import PostgreSQLIndex
+from tortoise.indexes import Index
 
 MAXLENGTH = 50
 
+
+class CoveringIndex(PostgreSQLIndex):
+    """B-tree index carrying extra `include` columns, so queries reading them can be index-only scans."""
+
+    INDEX_TYPE = "BTREE"
+
+    def __init__(self, *, fields, include, name=None):
+        super().__init__(fields=fields, name=name)
+        self.include = tuple(include)
+        self.extra = " INCLUDE ({})".format(", ".join(f'"{field}"' for field in include))
+
+    # compared by value so aerich doesn't see a changed index on every migration
+    def __eq__(self, other):
+        return (
+            type(other) is type(self)
+            and (other.fields, other.include, other.name) == (self.fields, self.include, self.name)
+        )
+
+    def __hash__(self):
+        return hash((tuple(self.fields), self.include, self.name))
+
+    def get_sql(self, schema_generator, model, safe):
+        if schema_generator.DIALECT == "postgres":
+            return super().get_sql(schema_generator, model, safe)
+        # a plain index elsewhere, e.g. on SQLite for benchmarks
+        return Index(fields=self.fields, name=self.name).get_sql(schema_generator, model, safe)
+
 def validate_non_negative(value):
     if value < 0:
         raise ValueError("Value must be non-negative")
@@ -15,28 +44,53 @@ class WorkoutPlan(models.Model):
     name = fields.CharField(max_length=25)
     description = fields.TextField()
 
+    class Meta:
+        indexes = (("user",),)
+
 
 class WorkoutSession(models.Model):
     user = fields.ForeignKeyField("models.User", on_delete=fields.CASCADE)
     date = fields.DatetimeField(auto_now_add=True)
     comments = fields.TextField()
 
+    class Meta:
+        # owner listing and owner + date range (weekly/monthly summaries)
+        indexes = (("user", "date"),)
+
 
 class ExerciseLog(models.Model):
+    user = fields.ForeignKeyField("models.User", on_delete=fields.CASCADE) # owner, denormalized from workout_session
     workout_session = fields.ForeignKeyField("models.WorkoutSession", on_delete=fields.CASCADE)
+    date = fields.DatetimeField() # denormalized from workout_session, the partition key when partitioned by month
     exercise = fields.ForeignKeyField("models.Exercise", on_delete=fields.CASCADE)
     sets = fields.IntField(validators=[validate_non_negative])
     reps = fields.IntField(validators=[validate_non_negative])
     intensity = fields.IntField(validators=[validate_non_negative])
     exertion_scale = fields.IntField(validators=[validate_non_negative])
 
+    class Meta:
+        indexes = (
+            # owner + date range, covering the columns summed by the summaries
+            CoveringIndex(
+                fields=("user_id", "date"),
+                include=("sets", "reps"),
+                name="idx_exerciselog_user_date_cover",
+            ),
+            ("workout_session",),
+            ("exercise",),
+        )
+
 
 class ExerciseSummary(models.Model):
+    user = fields.ForeignKeyField("models.User", on_delete=fields.CASCADE) # owner, denormalized from exercise_log
     exercise_log = fields.ForeignKeyField("models.ExerciseLog", on_delete=fields.CASCADE)
     total_sets = fields.IntField(validators=[validate_non_negative])
     total_reps = fields.IntField(validators=[validate_non_negative])
     total_holds = fields.IntField(validators=[validate_non_negative])
 
+    class Meta:
+        indexes = (("exercise_log",), ("user",))
+
 
 class Exercise(models.Model):
     user = fields.ForeignKeyField("models.User", on_delete=fields.CASCADE)
@@ -45,8 +99,56 @@ class Exercise(models.Model):
     category = fields.CharField(max_length=MAXLENGTH)
     muscle_group = fields.CharField(max_length=MAXLENGTH)
 
+    class Meta:
+        indexes = (("user",),)
+
 
 class CalendarEntry(models.Model):
     workout_session = fields.ForeignKeyField("models.WorkoutSession", on_delete=fields.CASCADE)
     date = fields.DatetimeField(auto_now=True)
 
+    class Meta:
+        indexes = (("workout_session",),)
+
+
+
+class WorkoutArchive(models.Model):
+    """A month of a user's archived workout history, see archive.py."""
+
+    user = fields.ForeignKeyField("models.User", on_delete=fields.CASCADE)
+    month = fields.DateField() # first day of the month
+    data = fields.BinaryField() # zlib compressed JSON, column lists per archived table
+    lookup = fields.JSONField(null=True) # id ranges and exercises in data, see archive.build_lookup
+    sessions = fields.JSONField(null=True) # the archived sessions, uncompressed for listing
+
+    class Meta:
+        unique_together = (("user", "month"),)
+
+
+class MonthlySummary(models.Model):
+    """The weekly summaries of a closed month, computed once, see get_monthly_exercise_summary."""
+
+    user = fields.ForeignKeyField("models.User", on_delete=fields.CASCADE)
+    month = fields.DateField() # first day of the month
+    data = fields.JSONField() # the response, one summary per week
+
+    class Meta:
+        unique_together = (("user", "month"),)
+
+
+class Job(models.Model):
+    """Deferred work, claimed and run by the job workers of jobs.py."""
+
+    name = fields.CharField(max_length=MAXLENGTH + 50) # of the handler registered with @job
+    payload = fields.JSONField(default=dict) # the handler's keyword arguments
+    key = fields.CharField(max_length=255, null=True, unique=True) # idempotency key, released once the job starts
+    status = fields.CharField(max_length=16, default="pending") # pending, running or failed, done jobs are deleted
+    attempts = fields.IntField(default=0)
+    max_attempts = fields.IntField(default=1)
+    run_at = fields.DatetimeField() # not before, pushed back between retries
+    locked_at = fields.DatetimeField(null=True) # when a worker claimed it
+    error = fields.TextField(null=True) # of the last failed attempt
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = (("status", "run_at"),)
@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+from settings import settings
+
+
+class OffloadQueueFull(Exception):
+    """
+    Raised when OFFLOAD_MAX_QUEUE tasks are already waiting for the pool.
+    """
+
+
+def _warm_up() -> None:
+    pass
+
+
+class OffloadPool:
+    """
+    A process pool for CPU-bound work, so it doesn't block the event loop serving the other routes.
+
+    Started and shut down in the app's lifespan. Tasks are module-level functions
+    taking and returning compact buffers, see analytics.py. Before `start`, or with
+    OFFLOAD_WORKERS set to 0, tasks run inline.
+    """
+
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self.workers = 0
+        self.in_flight = 0  # submitted and not finished, running or waiting
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        # tasks waiting for a free worker
+        return max(0, self.in_flight - self.workers)
+
+    async def start(self, workers: int = None) -> None:
+        """
+        Start the worker processes, and wait for them to be ready.
+
+        :param workers: The number of processes, defaults to OFFLOAD_WORKERS.
+        :return: None
+        """
+        workers = settings.OFFLOAD_WORKERS if workers is None else workers
+        if self._executor is not None or workers < 1:
+            return
+        # spawned, a fork would copy the event loop and the database pools
+        self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.workers = workers
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up) for _ in range(workers)))
+
+    async def shutdown(self) -> None:
+        """
+        Stop the worker processes, cancelling the tasks not started yet.
+
+        The running tasks are waited for in a thread, the event loop keeps serving meanwhile.
+
+        :return: None
+        """
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            self.workers = 0
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run a function in a worker process.
+
+        :param func: A module-level function, picklable by reference.
+        :param args: Its arguments, preferably bytes.
+        :return: What the function returns.
+        :raises OffloadQueueFull: If OFFLOAD_MAX_QUEUE tasks are already waiting.
+        """
+        if self._executor is None:
+            return func(*args)
+        if self.in_flight >= self.workers and self.queue_depth >= settings.OFFLOAD_MAX_QUEUE:
+            self.rejected += 1
+            raise OffloadQueueFull(f"{self.queue_depth} tasks are waiting for the process pool")
+        self.in_flight += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+offload_pool = OffloadPool()
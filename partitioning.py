@@ -0,0 +1,289 @@
+import argparse
+import logging
+import re
+from datetime import date
+from tortoise import Tortoise, run_async
+from tortoise.transactions import in_transaction
+from database import TORTOISE_ORM
+from jobs import enqueue, job
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Monthly range partitioning of the exercise logs on their `date` column.
+# WorkoutSession stays a plain table, it is referenced by the logs and calendar
+# entries and postgres can't reference a partitioned table by `id` alone.
+PARTITIONED_TABLE = "exerciselog"
+DEFAULT_PARTITION = f"{PARTITIONED_TABLE}_default"
+PARTITION_PATTERN = re.compile(rf"^{PARTITIONED_TABLE}_p(\d{{4}})_(\d{{2}})$")
+MAINTENANCE_INTERVAL = 24 * 60 * 60  # seconds
+MAINTENANCE_JOB_KEY = "maintain_partitions"
+
+
+def add_months(month: date, months: int) -> date:
+    """
+    Get the first day of the month `months` months away from the given month.
+
+    :param month: The starting month, any day of it.
+    :param months: The number of months to move, may be negative.
+    :return: The first day of the resulting month.
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITIONED_TABLE}_p{month.year}_{month.month:02d}"
+
+
+def partition_bounds(month: date) -> tuple[str, str]:
+    """
+    Get the UTC timestamps a month partition ranges over, end excluded.
+
+    :param month: Any day of the month.
+    :return: The start and end timestamps as SQL literals.
+    """
+    start = date(month.year, month.month, 1)
+    end = add_months(start, 1)
+    return f"'{start.isoformat()} 00:00:00+00'", f"'{end.isoformat()} 00:00:00+00'"
+
+
+async def is_partitioned() -> bool:
+    _, rows = await Tortoise.get_connection("default").execute_query(
+        "SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", [PARTITIONED_TABLE]
+    )
+    return bool(rows) and rows[0]["relkind"] == "p"
+
+
+async def get_partitions() -> list[str]:
+    """
+    Get the names of the partitions attached to the exercise log table.
+
+    :return: The partition names, the default partition included.
+    """
+    _, rows = await Tortoise.get_connection("default").execute_query(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass($1)",
+        [PARTITIONED_TABLE],
+    )
+    return sorted(row["relname"] for row in rows)
+
+
+async def create_month_partition(month: date) -> bool:
+    """
+    Create and attach the partition of a month, if it does not exist yet.
+
+    Rows of that month sitting in the default partition are moved into it.
+
+    :param month: Any day of the month.
+    :return: True if the partition was created.
+    """
+    name = partition_name(month)
+    connection = Tortoise.get_connection("default")
+    _, rows = await connection.execute_query("SELECT to_regclass($1) AS oid", [name])
+    if rows[0]["oid"] is not None:
+        return False
+    start, end = partition_bounds(month)
+    async with in_transaction("default") as transaction:
+        await transaction.execute_script(
+            f"""
+            CREATE TABLE "{name}" (LIKE "{PARTITIONED_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}" WHERE "date" >= {start} AND "date" < {end} RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved;
+            ALTER TABLE "{PARTITIONED_TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM ({start}) TO ({end});
+            """
+        )
+    logger.info("Created partition %s", name)
+    return True
+
+
+async def create_future_partitions(months_ahead: int = None) -> list[str]:
+    """
+    Make sure partitions exist from the current month up to `months_ahead` months ahead.
+
+    Does nothing when the exercise log table is not partitioned.
+
+    :param months_ahead: The number of future months, defaults to DB_PARTITION_MONTHS_AHEAD.
+    :return: The names of the created partitions.
+    """
+    if months_ahead is None:
+        months_ahead = settings.DB_PARTITION_MONTHS_AHEAD
+    if not await is_partitioned():
+        return []
+    this_month = date.today().replace(day=1)
+    created = []
+    for months in range(months_ahead + 1):
+        month = add_months(this_month, months)
+        if await create_month_partition(month):
+            created.append(partition_name(month))
+    return created
+
+
+async def detach_partitions(before: date) -> list[str]:
+    """
+    Detach the month partitions older than a month, to archive or drop them.
+
+    Detached partitions stay in the database as standalone tables.
+
+    :param before: Partitions of months before this one are detached.
+    :return: The names of the detached partitions.
+    """
+    cutoff = date(before.year, before.month, 1)
+    detached = []
+    for name in await get_partitions():
+        match = PARTITION_PATTERN.match(name)
+        if match is None or date(int(match[1]), int(match[2]), 1) >= cutoff:
+            continue
+        await Tortoise.get_connection("default").execute_script(
+            f'ALTER TABLE "{PARTITIONED_TABLE}" DETACH PARTITION "{name}";'
+        )
+        logger.info("Detached partition %s", name)
+        detached.append(name)
+    return detached
+
+
+async def convert_to_partitioned(months_ahead: int = None) -> bool:
+    """
+    Turn the exercise log table into a table partitioned by month, keeping its rows.
+
+    Runs in one transaction and locks the table while the rows are copied.
+    The primary key becomes (id, date), indexes and foreign keys are recreated
+    on the partitioned table. The exercise summaries' foreign key is replaced
+    by a trigger deleting them with their log, since postgres can't reference
+    a partitioned table by `id` alone.
+
+    :param months_ahead: The number of future months to create partitions for.
+    :return: True if the table was converted, False if it already was partitioned.
+    """
+    if months_ahead is None:
+        months_ahead = settings.DB_PARTITION_MONTHS_AHEAD
+    if await is_partitioned():
+        return False
+    old_table = f"{PARTITIONED_TABLE}_unpartitioned"
+    async with in_transaction("default") as connection:
+        _, indexes = await connection.execute_query(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = $1 "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass($1))",
+            [PARTITIONED_TABLE],
+        )
+        _, foreign_keys = await connection.execute_query(
+            "SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+            "WHERE conrelid = to_regclass($1) AND contype = 'f'",
+            [PARTITIONED_TABLE],
+        )
+        _, referencing = await connection.execute_query(
+            "SELECT conrelid::regclass::text AS table_name, conname FROM pg_constraint "
+            "WHERE confrelid = to_regclass($1) AND contype = 'f'",
+            [PARTITIONED_TABLE],
+        )
+        _, rows = await connection.execute_query(
+            f"""SELECT pg_get_serial_sequence('"{PARTITIONED_TABLE}"', 'id') AS sequence, """
+            f'min("date") AS first_date FROM "{PARTITIONED_TABLE}"'
+        )
+        sequence, first_date = rows[0]["sequence"], rows[0]["first_date"]
+
+        this_month = date.today().replace(day=1)
+        month = min(first_date.date().replace(day=1), this_month) if first_date else this_month
+        partitions = []
+        while month <= add_months(this_month, months_ahead):
+            start, end = partition_bounds(month)
+            partitions.append(
+                f'CREATE TABLE "{partition_name(month)}" PARTITION OF "{PARTITIONED_TABLE}" '
+                f"FOR VALUES FROM ({start}) TO ({end});"
+            )
+            month = add_months(month, 1)
+
+        statements = [
+            *(f'ALTER TABLE {row["table_name"]} DROP CONSTRAINT "{row["conname"]}";' for row in referencing),
+            f'ALTER TABLE "{PARTITIONED_TABLE}" RENAME TO "{old_table}";',
+            f'CREATE TABLE "{PARTITIONED_TABLE}" (LIKE "{old_table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS, '
+            f'PRIMARY KEY ("id", "date")) PARTITION BY RANGE ("date");',
+            f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARTITIONED_TABLE}" DEFAULT;',
+            *partitions,
+            f'INSERT INTO "{PARTITIONED_TABLE}" SELECT * FROM "{old_table}";',
+            f"ALTER SEQUENCE {sequence} OWNED BY NONE;",
+            f'DROP TABLE "{old_table}";',
+            f'ALTER SEQUENCE {sequence} OWNED BY "{PARTITIONED_TABLE}"."id";',
+            *(f'{row["indexdef"]};' for row in indexes),
+            *(
+                f'ALTER TABLE "{PARTITIONED_TABLE}" ADD CONSTRAINT "{row["conname"]}" {row["definition"]};'
+                for row in foreign_keys
+            ),
+            # Replaces the ON DELETE CASCADE of exercisesummary.exercise_log_id. A row moved
+            # to another partition by an update is still there, its summaries are kept.
+            f"""
+            CREATE OR REPLACE FUNCTION "{PARTITIONED_TABLE}_delete_summaries"() RETURNS trigger AS $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM "{PARTITIONED_TABLE}" WHERE "id" = OLD."id") THEN
+                    DELETE FROM "exercisesummary" WHERE "exercise_log_id" = OLD."id";
+                END IF;
+                RETURN OLD;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            f'CREATE TRIGGER "{PARTITIONED_TABLE}_delete_summaries" AFTER DELETE ON "{PARTITIONED_TABLE}" '
+            f'FOR EACH ROW EXECUTE FUNCTION "{PARTITIONED_TABLE}_delete_summaries"();',
+        ]
+        await connection.execute_script("\n".join(statements))
+    logger.info("Partitioned %s by month", PARTITIONED_TABLE)
+    return True
+
+
+async def schedule_partition_maintenance(delay: float = 0.0) -> None:
+    """
+    Enqueue the partition maintenance job, unless it is already waiting.
+
+    Every API worker calls it at startup, the job's key keeps a single one scheduled.
+
+    :param delay: Seconds before it runs.
+    :return: None
+    """
+    await enqueue("maintain_partitions", key=MAINTENANCE_JOB_KEY, delay=delay)
+
+
+@job(concurrency=1)
+async def maintain_partitions() -> None:
+    """
+    Create the future partitions, and schedule the next run MAINTENANCE_INTERVAL later.
+
+    Runs as a background job, so one worker creates them rather than every API process racing the others.
+
+    :return: None
+    """
+    try:
+        await create_future_partitions()
+    except Exception:
+        logger.exception("Failed to create future partitions of %s", PARTITIONED_TABLE)
+    await schedule_partition_maintenance(MAINTENANCE_INTERVAL)
+
+
+async def run(args: argparse.Namespace) -> None:
+    await Tortoise.init(config=TORTOISE_ORM)
+    if args.command == "convert":
+        converted = await convert_to_partitioned(args.months_ahead)
+        print(f"Partitioned {PARTITIONED_TABLE}" if converted else f"{PARTITIONED_TABLE} is already partitioned")
+    elif args.command == "create":
+        for name in await create_future_partitions(args.months_ahead):
+            print(f"Created {name}")
+    elif args.command == "detach":
+        for name in await detach_partitions(date.fromisoformat(args.before)):
+            print(f"Detached {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monthly partitions of the exercise log table")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="partition the existing table by month")
+    convert.add_argument("--months-ahead", type=int, default=None)
+    create = subparsers.add_parser("create", help="create the partitions of the coming months")
+    create.add_argument("--months-ahead", type=int, default=None)
+    detach = subparsers.add_parser("detach", help="detach the partitions of months before a date")
+    detach.add_argument("--before", required=True, help="YYYY-MM-DD")
+    run_async(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
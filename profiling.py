@@ -0,0 +1,169 @@
+import cProfile
+import hmac
+import io
+import itertools
+import marshal
+import pstats
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from settings import settings
+
+PROFILE_HEADER = b"x-profile"
+# phases reported from the profile: name -> (file ending, function name)
+PHASES = {
+    # the Azure token validation, with the other dependencies and the request parsing
+    "dependencies": ("fastapi/dependencies/utils.py", "solve_dependencies"),
+    "get_authenticated_user": ("controllers.py", "get_authenticated_user"),
+    "endpoint": ("fastapi/routing.py", "run_endpoint_function"),
+    "serialization": ("fastapi/routing.py", "serialize_response"),
+}
+TOP_FUNCTIONS = 40  # in the text report
+
+
+class ProfileStore:
+    """
+    The last PROFILING_MAX_REPORTS request profiles of the process, oldest dropped first.
+    """
+
+    def __init__(self, max_reports: int = None):
+        self.max_reports = max_reports or settings.PROFILING_MAX_REPORTS
+        self._reports: OrderedDict[int, dict] = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def add(self, report_id: int, report: dict) -> None:
+        self._reports[report_id] = {"id": report_id, **report}
+        while len(self._reports) > self.max_reports:
+            self._reports.popitem(last=False)
+
+    def get(self, report_id: int) -> dict | None:
+        return self._reports.get(report_id)
+
+    def list(self) -> list[dict]:
+        """
+        Get the stored reports, newest first, without their profiles.
+
+        :return: The reports' request, timings and phases.
+        """
+        return [
+            {key: value for key, value in report.items() if key not in ("stats", "text")}
+            for report in reversed(self._reports.values())
+        ]
+
+    def clear(self) -> None:
+        self._reports.clear()
+
+
+profile_store = ProfileStore()
+
+
+def has_profiling_token(token: str | None) -> bool:
+    """
+    Check a request is privileged to profile and read the reports.
+
+    :param token: The X-Profile header of the request.
+    :return: True if it is PROFILING_TOKEN, never when no token is set.
+    """
+    return bool(settings.PROFILING_TOKEN) and token is not None and hmac.compare_digest(
+        token.encode(), settings.PROFILING_TOKEN.encode()
+    )
+
+
+def get_phases(stats: pstats.Stats) -> dict[str, float]:
+    """
+    Get the cumulative time of each phase's function in a profile.
+
+    Time a coroutine spent awaiting is not in it, see the database phase for the queries.
+
+    :param stats: The profile.
+    :return: Seconds per phase, phases whose function didn't run are left out.
+    """
+    phases = {}
+    for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+        for phase, (file_ending, function_name) in PHASES.items():
+            if function == function_name and filename.replace("\\", "/").endswith(file_ending):
+                phases[phase] = phases.get(phase, 0.0) + cumulative
+    return phases
+
+
+def build_report(profiler: cProfile.Profile, scope: dict, status: int, seconds: float) -> dict:
+    stats = pstats.Stats(profiler)
+    text = io.StringIO()
+    stats.stream = text
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    query_stats = scope.get("state", {}).get("query_stats")
+    phases = get_phases(stats)
+    if query_stats is not None:
+        phases["database"] = query_stats.seconds
+    user = scope.get("state", {}).get("user")
+    return {
+        "method": scope["method"],
+        "path": scope["path"],
+        "status": status,
+        "user": getattr(user, "sub", None),
+        "started": datetime.now(timezone.utc).isoformat(),
+        "total_seconds": seconds,
+        "phases": phases,
+        "queries": query_stats.count if query_stats is not None else None,
+        "stats": marshal.dumps(stats.stats),
+        "text": text.getvalue(),
+    }
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling single requests with cProfile, into `profile_store`.
+
+    A request is profiled when it sends the X-Profile header with PROFILING_TOKEN,
+    or is picked at PROFILING_SAMPLE_RATE. Only one request is profiled at a time,
+    and other requests running concurrently in the event loop show up in its profile.
+    The report ID is sent back in the X-Profile-Id header. With no token and a
+    zero sample rate, requests go straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.profiling = False
+
+    def wants_profile(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return has_profiling_token(value.decode("latin-1"))
+        return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or (not settings.PROFILING_TOKEN and not settings.PROFILING_SAMPLE_RATE)
+            or self.profiling
+            or not self.wants_profile(scope)
+        ):
+            return await self.app(scope, receive, send)
+        status = 500
+        report_id = profile_store.next_id()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", []), (b"x-profile-id", str(report_id).encode())],
+                }
+            await send(message)
+
+        self.profiling = True
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            self.profiling = False
+        seconds = time.perf_counter() - started
+        profile_store.add(report_id, build_report(profiler, scope, status, seconds))
@@ -1,17 +1,44 @@
+import time
+
+STARTED_AT = time.perf_counter()  # before the imports, they take a good part of the startup
+
+import logging
 import uvicorn
-from database import TORTOISE_ORM, TORTOISE_ORM_TEST
+from database import (
+    TORTOISE_ORM,
+    check_schema_version,
+    get_pool_stats,
+)
 from datetime import datetime
 from fastapi import FastAPI, HTTPException, Security, Request, Response
+from fastapi.security import SecurityScopes
+from starlette.requests import HTTPConnection
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_azure_auth import B2CMultiTenantAuthorizationCodeBearer, user
 from tortoise.contrib.fastapi import RegisterTortoise
 from tortoise import Tortoise
+from tortoise.exceptions import ConfigurationError
 from models import *
 from schemas import *
 from settings import settings
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from controllers import *
+from partitioning import schedule_partition_maintenance
+from cache import exercise_catalog
+from helpers import is_closed_month
+from metrics import MetricsMiddleware, render_metrics
+from querystats import QueryStatsMiddleware
+from profiling import ProfilingMiddleware, has_profiling_token, profile_store
+from tracing import TracingMiddleware, start_span
+from offload import offload_pool
+from jobs import job_worker
+from ratelimit import LoadSheddingMiddleware
+from deadlines import DeadlineMiddleware
+from coalesce import single_flight
+from db_router import READ_METHODS
+
+logger = logging.getLogger("uvicorn.error")
 
 
 @asynccontextmanager
@@ -23,26 +50,48 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
 
     """
     if getattr(app.state, "testing", False):
-        # If we're in unit tests, create a DB with a dynamic name (the {} placeholder), create schemas and drop
-        # the database when the app's lifespan ends
-        # reference: https://github.com/tortoise/tortoise-orm/issues/1676#issuecomment-2239073869
-        async with RegisterTortoise(
-            app=app,
-            config=TORTOISE_ORM_TEST,
-            generate_schemas=True,
-            add_exception_handlers=True,
-        ):
-            yield
+        # In unit tests the database is set up once per session, with each test in a
+        # rolled back transaction, see conftest.py. Only the exception handlers are added.
+        RegisterTortoise(app=app, add_exception_handlers=True)
+        # the process pool and the job worker aren't started, analytics run inline and
+        # enqueued jobs wait unless a test starts them
+        yield
 
     else:
+        # migrations run beforehand as a one-shot `aerich upgrade`, startup only checks the version
+        imported = time.perf_counter()
         await azure_scheme.openid_config.load_config()
+        openid_loaded = time.perf_counter()
         async with RegisterTortoise(
             app,
             config=TORTOISE_ORM,
-            generate_schemas=True,
+            generate_schemas=settings.DB_GENERATE_SCHEMAS,
             add_exception_handlers=True,
         ):
-            yield
+            schema_version = None
+            if settings.DB_CHECK_SCHEMA_VERSION and not settings.DB_GENERATE_SCHEMAS:
+                schema_version = await check_schema_version()
+            ready = time.perf_counter()
+            app.state.startup = {
+                "total_seconds": ready - STARTED_AT,
+                "import_seconds": imported - STARTED_AT,
+                "openid_config_seconds": openid_loaded - imported,
+                "database_seconds": ready - openid_loaded,
+                "schema_version": schema_version,
+            }
+            logger.info(
+                "Started in %.3fs (imports %.3fs, OpenID config %.3fs, database %.3fs), schema %s",
+                *app.state.startup.values(),
+            )
+            if settings.DB_PARTITION_EXERCISE_LOGS:
+                await schedule_partition_maintenance()
+            await offload_pool.start()
+            job_worker.start()
+            try:
+                yield
+            finally:
+                await job_worker.stop()
+                await offload_pool.shutdown()
 
 
 app = FastAPI(
@@ -64,7 +113,42 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
-azure_scheme = B2CMultiTenantAuthorizationCodeBearer(
+
+@app.middleware("http")
+async def end_read_sharing_after_writes(request: Request, call_next):
+    """
+    Reads of a user started before one of their writes completed aren't shared with later ones.
+    """
+    response = await call_next(request)
+    user = getattr(request.state, "user", None)
+    if request.method not in READ_METHODS and user is not None:
+        single_flight.forget(user.sub)
+    return response
+
+
+# innermost, the middlewares around it see the 504s of the requests it cancels
+app.add_middleware(DeadlineMiddleware, routes=app.router.routes)
+# inside QueryStatsMiddleware, so its reports have the queries
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(TracingMiddleware)
+# sheds before any of the work the inner middlewares do
+app.add_middleware(LoadSheddingMiddleware)
+# outermost, so the latency covers the other middlewares
+app.add_middleware(MetricsMiddleware)
+
+
+class TracedB2CMultiTenantAuthorizationCodeBearer(B2CMultiTenantAuthorizationCodeBearer):
+    """
+    The Azure B2C scheme, validating the token in a span of the request's trace.
+    """
+
+    async def __call__(self, request: HTTPConnection, security_scopes: SecurityScopes) -> user.User | None:
+        with start_span("azure_scheme"):
+            return await super().__call__(request, security_scopes)
+
+
+azure_scheme = TracedB2CMultiTenantAuthorizationCodeBearer(
     app_client_id=settings.APP_CLIENT_ID,
     openid_config_url=settings.OPENID_CONFIG_URL,
     openapi_authorization_url=settings.OPENAPI_AUTHORIZATION_URL,
@@ -475,6 +559,29 @@ async def get_exercise(request: Request, id: int):
     return await get_user_exercise(id, user)
 
 
+@app.get(
+    "/exercise/{id}/progression",
+    response_model=list[ExerciseProgressionDay],
+    dependencies=[Security(azure_scheme)],
+)
+async def get_exercise_progression_report(request: Request, id: int):
+    """
+    Retrieve the daily progression of an exercise of the authenticated user.
+
+    Args:
+        request (Request): The incoming request object.
+        id (int): The ID of the exercise.
+
+    Returns:
+        list: The volume, top intensity, acute and chronic load of each training day.
+
+    Raises:
+        HTTPException: If the exercise does not exist, or the analytics workers are saturated.
+    """
+    user = await get_authenticated_user(request)
+    return await get_exercise_progression(id, user)
+
+
 @app.post(
     "/exercises",
     response_model=Exercise_Pydantic,
@@ -570,7 +677,9 @@ async def get_exercise_summary(request: Request, id: int):
     response_model=ExerciseSummary_Pydantic,
     dependencies=[Security(azure_scheme)],
 )
-async def create_exercise_summary(id: int, exercise_summary: ExerciseSummaryCreate):
+async def create_exercise_summary(
+    request: Request, id: int, exercise_summary: ExerciseSummaryCreate
+):
     """
     Create a new exercise summary for a specific exercise log for the authenticated user.
 
@@ -584,8 +693,8 @@ async def create_exercise_summary(id: int, exercise_summary: ExerciseSummaryCrea
     Raises:
         HTTPException: If there is an error creating the exercise summary.
     """
-
-    return await create_user_exercise_summary(id, exercise_summary)
+    user = await get_authenticated_user(request)
+    return await create_user_exercise_summary(id, user, exercise_summary)
 
 
 @app.patch(
@@ -627,12 +736,16 @@ async def delete_exercise_summary(request: Request, id: int) -> None:
     response_model=list[WeeklySummary_Pydantic],
     dependencies=[Security(azure_scheme)],
 )
-async def get_specific_month_summary(request: Request, year: int, month: int):
+async def get_specific_month_summary(
+    request: Request, response: Response, year: int, month: int
+):
     """
     Get the exercise summary for each week in a specific month and year for the authenticated user.
+    Summaries of closed months are cacheable by the client for CLOSED_SUMMARY_MAX_AGE.
 
     Args:
         request (Request): The incoming request object.
+        response (Response): The outgoing response, for its Cache-Control header.
         year (int): The year of the month to retrieve the summary for.
         month (int): The month to retrieve the summary for.
 
@@ -643,7 +756,139 @@ async def get_specific_month_summary(request: Request, year: int, month: int):
         HTTPException: If there is an error retrieving the exercise summary.
     """
     user = await get_authenticated_user(request)
-    return await get_monthly_exercise_summary(user, year, month)
+    summary = await get_monthly_exercise_summary(user, year, month)
+    if is_closed_month(year, month):
+        response.headers["Cache-Control"] = f"private, max-age={settings.CLOSED_SUMMARY_MAX_AGE}"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    return summary
+
+
+@app.get("/export/{table}", dependencies=[Security(azure_scheme)])
+async def export_table(request: Request, table: str, format: str = "ndjson"):
+    """
+    Stream the authenticated user's full history of a table.
+
+    Args:
+        request (Request): The incoming request object.
+        table (str): `workout-plans`, `workout-sessions`, `exercise-logs` or `exercises`.
+        format (str): `csv`, `ndjson` or `columnar`.
+
+    Returns:
+        StreamingResponse: The exported rows.
+
+    Raises:
+        HTTPException: If the table or format is unknown.
+    """
+    user = await get_authenticated_user(request)
+    return await export_user_table(user, table, format)
+
+
+@app.get("/health")
+async def health():
+    """
+    Readiness probe, also reports how long the process took to start.
+
+    Returns:
+        dict: The status and the startup timings, empty under tests.
+    """
+    return {"status": "ok", "startup": getattr(app.state, "startup", {})}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Request, database pool and cache metrics of this process, in the Prometheus text format.
+
+    Left unauthenticated for the scraper, keep it off the public ingress.
+
+    Returns:
+        Response: The metrics.
+    """
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/profiles", dependencies=[Security(azure_scheme)])
+async def get_profiles(request: Request):
+    """
+    List the stored request profiles, newest first. Needs the X-Profile token.
+
+    Args:
+        request (Request): The incoming request object.
+
+    Returns:
+        list[dict]: The request, status, total time and time per phase of each profile.
+
+    Raises:
+        HTTPException: If the request doesn't have the profiling token.
+    """
+    if not has_profiling_token(request.headers.get("x-profile")):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+    return profile_store.list()
+
+
+@app.get("/profiles/{id}", dependencies=[Security(azure_scheme)])
+async def download_profile(request: Request, id: int, format: str = "pstats"):
+    """
+    Download a request profile. Needs the X-Profile token.
+
+    Args:
+        request (Request): The incoming request object.
+        id (int): The ID sent back in the X-Profile-Id header of the profiled request.
+        format (str): `pstats`, a file for pstats or snakeviz, or `text`, the top functions.
+
+    Returns:
+        Response: The profile.
+
+    Raises:
+        HTTPException: If the request doesn't have the profiling token or the profile is not found.
+    """
+    if not has_profiling_token(request.headers.get("x-profile")):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+    report = profile_store.get(id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        return Response(report["text"], media_type="text/plain")
+    return Response(
+        report["stats"],
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{id}.prof"'},
+    )
+
+
+@app.get("/cache-stats", dependencies=[Security(azure_scheme)])
+async def get_cache_stats():
+    """
+    Get the hit rate of the in-process caches and of the read coalescing.
+
+    Returns:
+        dict: The hits, misses and hit rate of each cache, and the calls served by a shared read, since the process started.
+    """
+    return {
+        "exercise_catalog": exercise_catalog.stats(),
+        "single_flight": single_flight.stats(),
+    }
+
+
+@app.get("/db-pool", dependencies=[Security(azure_scheme)])
+async def get_db_pool_stats(connection: str = "default"):
+    """
+    Get the saturation of a database connection pool.
+
+    Args:
+        connection (str): The name of the connection, `default` or `replica`.
+
+    Returns:
+        dict: The pool size, idle and in-use connections, and the in-use ratio against the max size.
+
+    Raises:
+        HTTPException: If the connection is not configured.
+    """
+    try:
+        return get_pool_stats(connection)
+    except ConfigurationError:
+        raise HTTPException(status_code=404, detail="Connection not found")
 
 
 if __name__ == "__main__":
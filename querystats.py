@@ -0,0 +1,140 @@
+import functools
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Iterator
+from tortoise.backends.asyncpg.client import AsyncpgDBClient, TransactionWrapper
+from tortoise.backends.base_postgres.client import BasePostgresClient
+from settings import settings
+from slowlog import redact_sql, slow_query_log
+from tracing import current_span, start_span
+
+EXECUTE_METHODS = ("execute_insert", "execute_many", "execute_query", "execute_query_dict", "execute_script")
+MAX_RECORDED_QUERIES = 100  # per tracker, the count and time keep going
+
+# The trackers queries are currently recorded in, innermost last
+_trackers: ContextVar[tuple["QueryStats", ...]] = ContextVar("query_trackers", default=())
+
+
+class QueryStats:
+    """
+    The SQL statements run while a tracker was active, with their count and total time.
+    """
+
+    def __init__(self, scope: dict = None):
+        self.scope = scope  # of the request tracked, for its route
+        self.count = 0
+        self.seconds = 0.0
+        self.queries: list[tuple[str, float]] = []
+
+    def record(self, query: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        if len(self.queries) < MAX_RECORDED_QUERIES:
+            self.queries.append((query, seconds))
+
+
+def current_route(trackers: tuple[QueryStats, ...]) -> str | None:
+    for tracker in reversed(trackers):
+        route = (tracker.scope or {}).get("route")
+        if route is not None:
+            return route.path
+    return None
+
+
+def _query_span(query: str):
+    span = current_span()
+    if span is None or not span.sampled:
+        return nullcontext()
+    return start_span("db.query", **{"db.system": "postgresql", "db.statement": redact_sql(query)})
+
+
+def _instrumented(method):
+    @functools.wraps(method)
+    async def wrapper(self, query, *args, **kwargs):
+        trackers = _trackers.get()
+        if not trackers and not settings.SLOW_QUERY_THRESHOLD_MS and current_span() is None:
+            return await method(self, query, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            with _query_span(query):
+                return await method(self, query, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            for tracker in trackers:
+                tracker.record(query, seconds)
+            if slow_query_log.is_slow(seconds):
+                values = args[0] if args else kwargs.get("values")
+                if method.__name__ == "execute_many" and values:
+                    values = values[0]
+                slow_query_log.observe(self, method.__name__, query, values, seconds, current_route(trackers))
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_queries() -> None:
+    """
+    Make the postgres clients record their statements in the active trackers and
+    the current trace, and report the slow ones to the slow query log. Idempotent.
+
+    :return: None
+    """
+    for client_class in (BasePostgresClient, AsyncpgDBClient, TransactionWrapper):
+        for name in EXECUTE_METHODS:
+            method = vars(client_class).get(name)
+            if method is not None and not getattr(method, "instrumented", False):
+                setattr(client_class, name, _instrumented(method))
+
+
+@contextmanager
+def track_queries(scope: dict = None) -> Iterator[QueryStats]:
+    """
+    Record the statements run in the current context, nested trackers all record them.
+
+    Tasks started inside inherit the tracker, so statements of a coalesced read
+    count for the request that started it.
+
+    :param scope: The ASGI scope of the request tracked, if any.
+    :return: The stats, filled as statements run.
+    """
+    instrument_queries()
+    stats = QueryStats(scope)
+    token = _trackers.set((*_trackers.get(), stats))
+    try:
+        yield stats
+    finally:
+        _trackers.reset(token)
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware tracking the statements of each request, in `request.state.query_stats`.
+
+    With DEBUG_QUERY_HEADERS the count and time go out in the X-DB-Query-Count
+    and X-DB-Query-Time (milliseconds) response headers. A streamed body's
+    statements after the headers are not in them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with track_queries(scope) as stats:
+            scope.setdefault("state", {})["query_stats"] = stats
+
+            async def send_with_headers(message):
+                if message["type"] == "http.response.start" and settings.DEBUG_QUERY_HEADERS:
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (b"x-db-query-count", str(stats.count).encode()),
+                            (b"x-db-query-time", f"{stats.seconds * 1000:.3f}".encode()),
+                        ],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, send_with_headers)
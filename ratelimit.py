@@ -0,0 +1,280 @@
+import functools
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from fastapi import HTTPException
+from tortoise.backends.base.client import PoolConnectionWrapper
+from cache import LocalRedis
+from db_router import READ_METHODS
+from settings import settings
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # only needed for RATE_LIMIT_BACKEND="redis"
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+SHED_EXEMPT_PATHS = {"/health", "/metrics"}  # probes and scrapes keep working under load
+
+# KEYS[1]: the bucket, ARGV: now, rate per second, burst
+# returns the seconds to wait before a token is available, "0" when one was taken
+TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local now, rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def take_token(tokens: float, updated: float, now: float, rate: float, burst: int) -> tuple[float, float]:
+    """
+    Refill a token bucket since it was last updated, and take a token if there is one.
+
+    :param tokens: The tokens in the bucket when last updated.
+    :param updated: When it was last updated.
+    :param now: The current time, in seconds.
+    :param rate: The tokens added per second.
+    :param burst: The size of the bucket.
+    :return: The tokens left, and the seconds to wait for one, 0 if one was taken.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryRateLimiter:
+    """
+    Token buckets in the memory of the process, each worker limits on its own.
+    """
+
+    def __init__(self, max_keys: int = None):
+        self.max_keys = max_keys or settings.RATE_LIMIT_MAX_KEYS
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens, wait = take_token(tokens, updated, now, rate, burst)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class LocalRedisRateLimit(LocalRedis):
+    """
+    LocalRedis, also running the token bucket script, for tests and single process development.
+    """
+
+    async def eval(self, script, numkeys, key, now, rate, burst):
+        if script != TOKEN_BUCKET_SCRIPT:
+            raise NotImplementedError("LocalRedisRateLimit only runs the token bucket script")
+        state = await self.get(key)
+        tokens, updated = map(float, state.split(b":")) if state else (float(burst), float(now))
+        tokens, wait = take_token(tokens, updated, float(now), float(rate), int(burst))
+        await self.set(key, f"{tokens}:{now}", ex=math.ceil(int(burst) / float(rate)) + 1)
+        return str(wait).encode()
+
+
+class RedisRateLimiter:
+    """
+    Token buckets in redis, shared by all the workers.
+
+    Redis failures are logged and let the request through, the limiter isn't worth an outage.
+    """
+
+    def __init__(self, client=None, prefix: str = "repitup:rate:"):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package installed")
+            client = redis.from_url(settings.RATE_LIMIT_URL)
+        self.client = client
+        self.prefix = prefix
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        try:
+            wait = await self.client.eval(TOKEN_BUCKET_SCRIPT, 1, self.prefix + key, time.time(), rate, burst)
+        except Exception:
+            logger.exception("Rate limit check of %s failed", key)
+            return 0.0
+        return float(wait)
+
+
+def create_rate_limiter(backend: str = None):
+    """
+    Create the rate limiter backend named in the settings.
+
+    :param backend: `memory`, `redis`, `local-redis` or `none`, defaults to RATE_LIMIT_BACKEND.
+    :return: The limiter, None for `none`.
+    """
+    backend = backend or settings.RATE_LIMIT_BACKEND
+    if backend == "memory":
+        return MemoryRateLimiter()
+    if backend == "redis":
+        return RedisRateLimiter()
+    if backend == "local-redis":
+        return RedisRateLimiter(LocalRedisRateLimit())
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+rate_limiter = create_rate_limiter()
+# requests refused by the rate limiter, per route class
+rate_limited = {"read": 0, "write": 0}
+
+
+def set_rate_limiter(limiter) -> None:
+    """
+    Replace the rate limiter backend, e.g. in tests.
+
+    :param limiter: The new backend, None disables rate limiting.
+    :return: None
+    """
+    global rate_limiter
+    rate_limiter = limiter
+
+
+async def check_rate_limit(user_id: str, method: str) -> None:
+    """
+    Take a token from the user's bucket for the route class of the request.
+
+    Reads and writes have their own buckets, RATE_LIMIT_READS_PER_SECOND and
+    RATE_LIMIT_WRITES_PER_SECOND, a zero rate leaves the class unlimited.
+
+    :param user_id: The `sub` of the authenticated user.
+    :param method: The HTTP method of the request.
+    :return: None
+    :raises HTTPException: 429 with Retry-After if the bucket is empty.
+    """
+    if rate_limiter is None:
+        return
+    if method in READ_METHODS:
+        route_class, rate, burst = "read", settings.RATE_LIMIT_READS_PER_SECOND, settings.RATE_LIMIT_READ_BURST
+    else:
+        route_class, rate, burst = "write", settings.RATE_LIMIT_WRITES_PER_SECOND, settings.RATE_LIMIT_WRITE_BURST
+    if not rate:
+        return
+    wait = await rate_limiter.acquire(f"{route_class}:{user_id}", rate, max(1, burst))
+    if wait > 0:
+        rate_limited[route_class] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+
+class PoolWaitMonitor:
+    """
+    How long queries wait for a connection from the pools, over the last DB_POOL_WAIT_WINDOW seconds.
+
+    Acquisitions still waiting count with their wait so far, so a pool stuck
+    at capacity shows up before any of them gets a connection.
+    """
+
+    def __init__(self):
+        self._waits: deque[tuple[float, float]] = deque()  # (finished, seconds waited)
+        self._total = 0.0  # of the waits in the window
+        self._waiting: dict[int, float] = {}  # acquisition -> started
+        self.shed = 0
+
+    def started(self, acquisition: int) -> None:
+        self._waiting[acquisition] = time.monotonic()
+
+    def finished(self, acquisition: int) -> None:
+        started = self._waiting.pop(acquisition, None)
+        if started is not None:
+            now = time.monotonic()
+            self._waits.append((now, now - started))
+            self._total += now - started
+
+    def wait_time(self) -> float:
+        """
+        Get the average wait of the recent acquisitions, or the longest current wait if longer.
+
+        :return: Seconds.
+        """
+        now = time.monotonic()
+        while self._waits and now - self._waits[0][0] > settings.DB_POOL_WAIT_WINDOW:
+            self._total -= self._waits.popleft()[1]
+        average = self._total / len(self._waits) if self._waits else 0.0
+        longest = now - min(self._waiting.values()) if self._waiting else 0.0
+        return max(average, longest)
+
+    def reset(self) -> None:
+        self._waits.clear()
+        self._total = 0.0
+
+    def overloaded(self) -> bool:
+        return 0 < settings.DB_POOL_WAIT_SHED_MS <= self.wait_time() * 1000
+
+
+pool_waits = PoolWaitMonitor()
+
+
+def instrument_pool_waits() -> None:
+    """
+    Make the Tortoise pool wrappers report their connection acquisitions to `pool_waits`. Idempotent.
+
+    :return: None
+    """
+    enter = PoolConnectionWrapper.__aenter__
+    if getattr(enter, "instrumented", False):
+        return
+
+    @functools.wraps(enter)
+    async def timed_enter(self):
+        pool_waits.started(id(self))
+        try:
+            return await enter(self)
+        finally:
+            pool_waits.finished(id(self))
+
+    timed_enter.instrumented = True
+    PoolConnectionWrapper.__aenter__ = timed_enter
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI middleware refusing requests with 503 and Retry-After while the database pools are saturated.
+
+    Saturation is when connections have been waited for DB_POOL_WAIT_SHED_MS on
+    average lately, refused requests then don't add to the queue. /health and
+    /metrics are never refused.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        instrument_pool_waits()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in SHED_EXEMPT_PATHS or not pool_waits.overloaded():
+            return await self.app(scope, receive, send)
+        pool_waits.shed += 1
+        body = b'{"detail":"Server overloaded, retry later"}'
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(settings.LOAD_SHED_RETRY_AFTER).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
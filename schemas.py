@@ -126,3 +126,12 @@ class WeeklySummary_Pydantic(BaseModel):
     week_start: date
     week_end: date
     summary: WeeklySummary
+
+
+class ExerciseProgressionDay(BaseModel):
+    date: date
+    volume: int
+    top_intensity: int
+    acute_load: float
+    chronic_load: float
+    load_ratio: float
@@ -0,0 +1,134 @@
+"""
+Production entry point: uvicorn with one worker process per CPU core.
+
+    python server.py
+    python server.py --workers 4 --port 8080
+
+`project.main()` stays the development server, with reload. Here SIGTERM
+makes uvicorn stop accepting connections and gives the in-flight requests
+SERVER_GRACEFUL_SHUTDOWN seconds to finish, before the lifespan closes the
+database pools of each worker.
+"""
+import argparse
+import logging
+import math
+import os
+import uvicorn
+from settings import settings
+
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+# cache backends whose entries stay in each worker process
+PER_PROCESS_CACHES = {"memory", "local-redis"}
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def available_cpus() -> int:
+    """
+    Count the CPU cores the process may use, a container's CPU quota included.
+
+    :return: The core count, at least 1.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    try:
+        with open(CGROUP_CPU_MAX) as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def worker_count() -> int:
+    """
+    Get the number of worker processes, SERVER_WORKERS or one per available core.
+
+    :return: The worker count.
+    """
+    return settings.SERVER_WORKERS or available_cpus()
+
+
+def pool_sizes(workers: int) -> tuple[int, int]:
+    """
+    Size each worker's connection pool so all of them fit DB_MAX_CONNECTIONS.
+
+    With no budget set, every worker keeps DB_POOL_MIN_SIZE and DB_POOL_MAX_SIZE.
+
+    :param workers: The number of worker processes.
+    :return: The minimum and maximum pool size of a worker.
+    """
+    if not settings.DB_MAX_CONNECTIONS:
+        return settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE
+    max_size = settings.DB_MAX_CONNECTIONS // workers
+    if max_size < 1:
+        raise ValueError(
+            f"DB_MAX_CONNECTIONS={settings.DB_MAX_CONNECTIONS} can't give {workers} workers a connection each"
+        )
+    return min(settings.DB_POOL_MIN_SIZE, max_size), max_size
+
+
+def check_shared_state(workers: int) -> None:
+    """
+    Check the workers can share the state the app keeps in the cache backend.
+
+    Summary evictions go through the cache backend, and so do the writes that
+    keep a user's reads on the primary. With a per process backend, a write
+    through one worker is not seen by the others: they serve stale summaries
+    for up to CACHE_TTL, and with a replica, read lagging copies of the
+    user's own writes. The latter is refused, the former logged.
+
+    :param workers: The number of worker processes.
+    :raises ValueError: If a replica is configured and the writes can't be shared.
+    :return: None
+    """
+    backend = settings.CACHE_BACKEND
+    shared = backend not in PER_PROCESS_CACHES and backend != "none"
+    if os.getenv("REPLICA_HOST") and (backend == "none" or (workers > 1 and not shared)):
+        raise ValueError(
+            f"CACHE_BACKEND={backend} can't share the read-your-writes window of {workers} workers "
+            "with a replica, use CACHE_BACKEND=redis"
+        )
+    if workers > 1 and not shared:
+        logger.warning(
+            "CACHE_BACKEND=%s is per worker, writes only evict the cached summaries of the worker "
+            "they went through, the others serve theirs for up to CACHE_TTL. Use CACHE_BACKEND=redis",
+            backend,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=worker_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    check_shared_state(args.workers)
+    min_size, max_size = pool_sizes(args.workers)
+    # the workers are fresh processes, they read their settings from the environment
+    os.environ["DB_POOL_MIN_SIZE"] = str(min_size)
+    os.environ["DB_POOL_MAX_SIZE"] = str(max_size)
+    logger.info(
+        "Starting %d workers on %s:%d, database pools of %d-%d connections each",
+        args.workers, args.host, args.port, min_size, max_size,
+    )
+    uvicorn.run(
+        "project:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEP_ALIVE,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_SHUTDOWN,
+    )
+
+
+if __name__ == "__main__":
+    main()
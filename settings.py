@@ -9,6 +9,90 @@ class Settings(BaseSettings):
     AUTH_POLICY_NAME: str = ""
     SCOPE_DESCRIPTION: str = "user_impersonation"
 
+    # asyncpg connection pool
+    DB_PORT: int = 5432
+    DB_POOL_MIN_SIZE: int = 1
+    DB_POOL_MAX_SIZE: int = 10
+    DB_POOL_MAX_QUERIES: int = 50000  # queries served before a connection is recycled
+    DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME: float = 300.0  # seconds
+    DB_STATEMENT_CACHE_SIZE: int = 100  # 0 disables it, needed behind pgbouncer in transaction mode
+    DB_CONNECT_TIMEOUT: int = 60  # seconds
+    DB_COMMAND_TIMEOUT: float = 30.0  # seconds a statement may run before asyncpg cancels it on the server
+    # total connections the workers of server.py share, split into per-worker pools; 0 keeps the sizes above
+    DB_MAX_CONNECTIONS: int = 0
+    # production startup: the schema is migrated by `aerich upgrade` beforehand, not generated
+    DB_GENERATE_SCHEMAS: bool = False
+    DB_CHECK_SCHEMA_VERSION: bool = True  # refuse to start on a database behind the migrations
+    # request deadlines, see deadlines.py; 0 for none
+    REQUEST_DEADLINE: float = 15.0  # seconds until the response starts
+    REQUEST_DEADLINES: dict[str, float] = {}  # per route template, e.g. {"/exercise-summary/{year}/{month}": 5}
+    # load shedding, see ratelimit.py: 503s while connections are waited for this long on average; 0 disables it
+    DB_POOL_WAIT_SHED_MS: float = 250.0
+    DB_POOL_WAIT_WINDOW: float = 1.0  # seconds of acquisitions averaged
+    LOAD_SHED_RETRY_AFTER: int = 1  # seconds
+    # read replica
+    DB_READ_YOUR_WRITES_WINDOW: float = 5.0  # seconds a user's reads stay on the primary after a write
+    # monthly partitions of the exercise logs, see partitioning.py
+    DB_PARTITION_EXERCISE_LOGS: bool = False  # create future partitions in the background
+    DB_PARTITION_MONTHS_AHEAD: int = 3
+    # workout history older than this is moved to the archive by archive.py
+    ARCHIVE_AFTER_DAYS: int = 180
+    # response cache of the summaries, see cache.py
+    CACHE_BACKEND: str = "memory"  # memory, redis, local-redis or none
+    CACHE_URL: str = "redis://localhost:6379/0"
+    CACHE_TTL: float = 300.0  # seconds, bounds staleness the write-driven eviction misses
+    CACHE_MAX_ENTRIES: int = 10000  # per process, memory backend only
+    # max-age of the closed months' summaries, a backdated log only shows up once it expires
+    CLOSED_SUMMARY_MAX_AGE: int = 86400  # seconds
+    # send the SQL statement count and time of each request in X-DB-Query-* headers
+    DEBUG_QUERY_HEADERS: bool = False
+    # slow query log with EXPLAIN output, see slowlog.py; 0 disables it
+    SLOW_QUERY_THRESHOLD_MS: float = 0.0
+    SLOW_QUERY_LOG_FILE: str = "slow_queries.log"
+    SLOW_QUERY_LOG_MAX_BYTES: int = 10_000_000  # rotated past this
+    SLOW_QUERY_LOG_BACKUPS: int = 5
+    SLOW_QUERY_MAX_CAPTURES_PER_MINUTE: int = 10  # each runs an EXPLAIN, SELECTs are run again
+    # on-demand profiling, see profiling.py; both off by default
+    PROFILING_TOKEN: str = ""  # requests sending it in X-Profile are profiled
+    PROFILING_SAMPLE_RATE: float = 0.0  # share of requests profiled at random
+    PROFILING_MAX_REPORTS: int = 50
+    # request tracing, see tracing.py; 0 disables it
+    TRACING_SAMPLE_RATE: float = 0.0  # share of requests traced, unless the caller's traceparent decides
+    TRACING_EXPORTER: str = "file"  # file or memory
+    TRACING_FILE: str = "traces.jsonl"
+    # per user token buckets, see ratelimit.py; a zero rate leaves the route class unlimited
+    RATE_LIMIT_BACKEND: str = "memory"  # memory (per worker), redis, local-redis or none
+    RATE_LIMIT_URL: str = "redis://localhost:6379/0"
+    RATE_LIMIT_READS_PER_SECOND: float = 20.0
+    RATE_LIMIT_READ_BURST: int = 40
+    RATE_LIMIT_WRITES_PER_SECOND: float = 5.0
+    RATE_LIMIT_WRITE_BURST: int = 20
+    RATE_LIMIT_MAX_KEYS: int = 100000  # buckets kept per process, memory backend only
+    # per process cache of the users' exercises
+    CATALOG_CACHE_MAX_USERS: int = 10000
+    CATALOG_CACHE_TTL: float = 60.0  # seconds, picks up writes through other workers
+    # process pool of the CPU-bound analytics, per API worker, see offload.py; 0 runs them inline
+    OFFLOAD_WORKERS: int = 1
+    OFFLOAD_MAX_QUEUE: int = 32  # tasks waiting for a worker before requests get a 503
+    # background jobs in the job table, see jobs.py
+    JOB_CONCURRENCY: int = 4  # jobs each API worker runs at once, 0 leaves them to `python jobs.py`
+    JOB_POLL_INTERVAL: float = 5.0  # seconds, jobs enqueued through the same process start right away
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BACKOFF: float = 10.0  # seconds before the first retry, doubled after each
+    JOB_TIMEOUT: float = 300.0  # seconds an attempt may run, a job locked twice as long is run again
+    JOB_SHUTDOWN_TIMEOUT: float = 10.0  # seconds running jobs get to finish, the rest are put back
+    # rows fetched per server-side cursor round trip and per streamed chunk of /export
+    EXPORT_CHUNK_SIZE: int = 1000
+    # production server, see server.py
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0  # 0 is one per available CPU core
+    SERVER_LOOP: str = "auto"  # uvloop when installed, else asyncio
+    SERVER_HTTP: str = "auto"  # httptools when installed, else h11
+    SERVER_BACKLOG: int = 2048
+    SERVER_KEEP_ALIVE: int = 75  # seconds, above the load balancer's idle timeout so it closes connections first
+    SERVER_GRACEFUL_SHUTDOWN: int = 30  # seconds in-flight requests get to finish on SIGTERM
+
     @computed_field
     @property
     def SCOPE_NAME(self) -> str:
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from settings import settings
+
+CAPTURE_WINDOW = 60.0  # seconds, SLOW_QUERY_MAX_CAPTURES_PER_MINUTE are allowed in it
+EXPLAIN_TIMEOUT_MS = 10000  # the EXPLAIN ANALYZE runs the query again, bounded by this
+
+# Tortoise inlines the values of most queries into the SQL
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+logger = logging.getLogger("repitup.slow_queries")
+logger.propagate = False
+
+
+def redact(values) -> list[str]:
+    """
+    Redact query parameters down to their types, user data never goes to the log.
+
+    :param values: The parameters of the query.
+    :return: The type name of each parameter.
+    """
+    return [type(value).__name__ for value in values or ()]
+
+
+def redact_sql(sql: str) -> str:
+    """
+    Redact the string literals of a query or plan, the numbers (IDs, limits) are kept.
+
+    :param sql: The SQL or EXPLAIN output.
+    :return: It with each string literal replaced by '?'.
+    """
+    return STRING_LITERAL.sub("'?'", sql)
+
+
+def is_read_only(query: str) -> bool:
+    # data-modifying CTEs aside, only these can be run again by EXPLAIN ANALYZE
+    return query.lstrip().upper().startswith("SELECT")
+
+
+async def explain_query(client, query: str, values) -> str:
+    """
+    Get the plan of a query, on a connection of its own from the client's pool.
+
+    SELECTs get `EXPLAIN (ANALYZE, BUFFERS)`, run again in a read-only
+    transaction. Other statements only get the plan, without running them.
+
+    :param client: The Tortoise client the query ran on.
+    :param query: The SQL of the query.
+    :param values: Its parameters.
+    :return: The EXPLAIN output.
+    """
+    # a transaction's connection is busy with the request, use its pool
+    client = getattr(client, "_parent", client)
+    options = "(ANALYZE, BUFFERS) " if is_read_only(query) else ""
+    async with client.acquire_connection() as connection:
+        async with connection.transaction(readonly=True):
+            await connection.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+            rows = await connection.fetch(f"EXPLAIN {options}{query}", *(values or ()))
+    return "\n".join(row[0] for row in rows)
+
+
+class SlowQueryLog:
+    """
+    Captures queries slower than SLOW_QUERY_THRESHOLD_MS, with their EXPLAIN, to a rotating log file.
+
+    At most SLOW_QUERY_MAX_CAPTURES_PER_MINUTE are captured, slow queries over it
+    are only counted. Captures run in the background, the request that ran the
+    query doesn't wait for the EXPLAIN.
+    """
+
+    def __init__(self):
+        self.captured = 0
+        self.skipped = 0
+        self._captures: deque[float] = deque()
+        self._tasks: set[asyncio.Task] = set()
+        self._handler: RotatingFileHandler | None = None
+
+    def is_slow(self, seconds: float) -> bool:
+        return 0 < settings.SLOW_QUERY_THRESHOLD_MS <= seconds * 1000
+
+    def _allow(self) -> bool:
+        now = time.monotonic()
+        while self._captures and now - self._captures[0] >= CAPTURE_WINDOW:
+            self._captures.popleft()
+        if len(self._captures) >= settings.SLOW_QUERY_MAX_CAPTURES_PER_MINUTE:
+            return False
+        self._captures.append(now)
+        return True
+
+    def _get_logger(self) -> logging.Logger:
+        # (re)opened on first use, and when SLOW_QUERY_LOG_FILE changes
+        if self._handler is None or self._handler.baseFilename != os.path.abspath(settings.SLOW_QUERY_LOG_FILE):
+            if self._handler is not None:
+                logger.removeHandler(self._handler)
+                self._handler.close()
+            self._handler = RotatingFileHandler(
+                settings.SLOW_QUERY_LOG_FILE,
+                maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+                backupCount=settings.SLOW_QUERY_LOG_BACKUPS,
+                encoding="utf-8",
+                delay=True,
+            )
+            logger.addHandler(self._handler)
+            logger.setLevel(logging.INFO)
+        return logger
+
+    def observe(self, client, method: str, query: str, values, seconds: float, route: str | None) -> None:
+        """
+        Capture a slow query in the background, if the rate limit allows.
+
+        :param client: The Tortoise client it ran on.
+        :param method: The client method that ran it, e.g. execute_query.
+        :param query: The SQL.
+        :param values: Its parameters, only their types are logged.
+        :param seconds: How long it took.
+        :param route: The route template of the request, None outside requests.
+        :return: None
+        """
+        if not self._allow():
+            self.skipped += 1
+            return
+        self.captured += 1
+        task = asyncio.get_running_loop().create_task(
+            self._capture(client, method, query, values, seconds, route)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _capture(self, client, method: str, query: str, values, seconds: float, route: str | None) -> None:
+        if method == "execute_script":
+            explain = None  # possibly several statements
+        else:
+            try:
+                explain = await explain_query(client, query, values)
+            except Exception as e:
+                explain = f"EXPLAIN failed: {e}"
+        self._get_logger().info(
+            json.dumps(
+                {
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "route": route,
+                    "connection": client.connection_name,
+                    "duration_ms": round(seconds * 1000, 3),
+                    "query": redact_sql(query),
+                    "params": redact(values),
+                    "explain": redact_sql(explain) if explain else explain,
+                }
+            )
+        )
+
+    async def drain(self) -> None:
+        """
+        Wait for the captures in progress to be written.
+
+        :return: None
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"captured": self.captured, "skipped": self.skipped}
+
+
+slow_query_log = SlowQueryLog()
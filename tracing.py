@@ -0,0 +1,296 @@
+import functools
+import json
+import logging
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Awaitable, Callable, Iterator
+import fastapi.routing
+from settings import settings
+
+TRACEPARENT_HEADER = b"traceparent"
+# version-trace_id-parent_id-flags, https://www.w3.org/TR/trace-context/#traceparent-header
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+SAMPLED_FLAG = 0x01
+MAX_SPANS_PER_TRACE = 1000  # spans past it are dropped, the trace is still exported
+TRACE_FILE_MAX_BYTES = 10_000_000  # the file exporter rotates past this
+TRACE_FILE_BACKUPS = 5
+
+# The span code currently runs in, None outside traced requests
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation of a trace, its spans are collected by the root one and exported with it.
+    """
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "attributes", "sampled", "status", "start", "end", "trace",
+    )
+
+    def __init__(
+        self, name: str, trace_id: str, parent_id: str | None, sampled: bool, trace: list = None, **attributes
+    ):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.sampled = sampled
+        self.status = "ok"
+        self.start = time.time_ns()
+        self.end = None
+        self.trace = [] if trace is None else trace  # shared by the spans of the trace
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{SAMPLED_FLAG if self.sampled else 0:02x}"
+
+    def finish(self) -> None:
+        self.end = time.time_ns()
+        if self.sampled and len(self.trace) < MAX_SPANS_PER_TRACE:
+            self.trace.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_unix_nano": self.start,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class FileSpanExporter:
+    """
+    Writes finished traces to a rotating file, one JSON span per line.
+    """
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger("repitup.traces")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = RotatingFileHandler(
+            path, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS, encoding="utf-8", delay=True
+        )
+        self.logger.addHandler(self.handler)
+
+    def export(self, spans: list[Span]) -> None:
+        for span in spans:
+            self.logger.info(json.dumps(span.to_dict(), default=str))
+
+    def close(self) -> None:
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+
+class MemorySpanExporter:
+    """
+    Keeps the last finished spans in memory, a stand-in collector for tests and local debugging.
+    """
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans: deque[dict] = deque(maxlen=max_spans)
+
+    def export(self, spans: list[Span]) -> None:
+        self.spans.extend(span.to_dict() for span in spans)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+    def close(self) -> None:
+        pass
+
+
+def create_exporter() -> FileSpanExporter | MemorySpanExporter:
+    """
+    Create the span exporter configured by TRACING_EXPORTER.
+
+    :return: The exporter.
+    :raises ValueError: If TRACING_EXPORTER is not file or memory.
+    """
+    if settings.TRACING_EXPORTER == "file":
+        return FileSpanExporter(settings.TRACING_FILE)
+    if settings.TRACING_EXPORTER == "memory":
+        return MemorySpanExporter()
+    raise ValueError(f"Unknown TRACING_EXPORTER {settings.TRACING_EXPORTER!r}")
+
+
+_exporter = None
+
+
+def get_exporter() -> FileSpanExporter | MemorySpanExporter:
+    global _exporter
+    if _exporter is None:
+        _exporter = create_exporter()
+    return _exporter
+
+
+def set_exporter(exporter) -> None:
+    global _exporter
+    if _exporter is not None and _exporter is not exporter:
+        _exporter.close()
+    _exporter = exporter
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def parse_traceparent(value: str | None) -> tuple[str, str, bool] | None:
+    """
+    Parse a W3C traceparent header.
+
+    :param value: The header value.
+    :return: The trace ID, parent span ID and sampled flag, None if missing or invalid.
+    """
+    match = TRACEPARENT.match(value.strip().lower()) if value else None
+    if match is None or match[1] == "0" * 32 or match[2] == "0" * 16:
+        return None
+    return match[1], match[2], bool(int(match[3], 16) & SAMPLED_FLAG)
+
+
+def start_trace(name: str, traceparent: str | None, **attributes) -> Span:
+    """
+    Start the root span of a request, continuing the caller's trace if it sent one.
+
+    The sampling decision of the caller is kept, otherwise requests are sampled
+    at TRACING_SAMPLE_RATE. Unsampled requests still propagate their trace
+    context, but record no spans.
+
+    :param name: The span name.
+    :param traceparent: The traceparent header of the request.
+    :return: The root span.
+    """
+    parent = parse_traceparent(traceparent)
+    if parent is None:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        sampled = random.random() < settings.TRACING_SAMPLE_RATE
+    else:
+        trace_id, parent_id, sampled = parent
+    return Span(name, trace_id, parent_id, sampled, **attributes)
+
+
+@contextmanager
+def start_span(name: str, **attributes) -> Iterator[Span | None]:
+    """
+    Time a block as a child of the current span, nothing is recorded outside sampled traces.
+
+    :param name: The span name.
+    :param attributes: Attributes of the span.
+    :return: The span, None when not recorded.
+    """
+    parent = _current_span.get()
+    if parent is None or not parent.sampled:
+        yield None
+        return
+    span = Span(name, parent.trace_id, parent.span_id, True, parent.trace, **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "error"
+        span.attributes["exception"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+
+
+def traced(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Run each call of a coroutine function in a span named after it.
+
+    :param func: The coroutine function, e.g. a controller.
+    :return: The traced function.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return await func(*args, **kwargs)
+        with start_span(name):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_serialization() -> None:
+    """
+    Trace FastAPI's response serialization, the validation and dump of the response model. Idempotent.
+
+    :return: None
+    """
+    serialize_response = fastapi.routing.serialize_response
+    if not getattr(serialize_response, "traced", False):
+        wrapper = traced(serialize_response)
+        wrapper.traced = True
+        fastapi.routing.serialize_response = wrapper
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the root span of each request, and exporting its trace once done.
+
+    The W3C traceparent of the request is continued, and the request's own is
+    sent back in the traceparent response header. With a zero
+    TRACING_SAMPLE_RATE requests go straight through, unless the caller's
+    trace is sampled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        instrument_serialization()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == TRACEPARENT_HEADER:
+                traceparent = value.decode("latin-1")
+                break
+        if not settings.TRACING_SAMPLE_RATE:
+            parent = parse_traceparent(traceparent)
+            if parent is None or not parent[2]:
+                return await self.app(scope, receive, send)
+        span = start_trace(
+            scope["method"], traceparent, **{"http.method": scope["method"], "http.target": scope["path"]}
+        )
+        token = _current_span.set(span)
+
+        async def send_with_traceparent(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.status = "error"
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", []), (TRACEPARENT_HEADER, span.traceparent.encode())],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_traceparent)
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                span.name = f"{scope['method']} {route.path}"
+                span.attributes["http.route"] = route.path
+            span.finish()
+            if span.sampled:
+                get_exporter().export(sorted(span.trace, key=lambda trace_span: trace_span.start))